@@ -0,0 +1,248 @@
+"""Revenue and conversion rollups pushed down to MongoDB aggregation.
+
+Mongo does the scanning and grouping per (day, plan); the handful of
+resulting rows are joined and rolled up with pandas. Results are cached
+per query and dropped whenever a new order is recorded.
+
+Checkout sessions are counted from ``payment_transactions``, whose unpaid
+rows expire after ``UNPAID_TRANSACTION_TTL_DAYS``. Before that happens,
+``rollup_checkout_sessions`` (run by the storage tiering job) stores each
+settled day's counts in ``checkout_sessions_daily``, and days it covers are
+read from there. Otherwise old windows would only count paid sessions.
+"""
+import asyncio
+import logging
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from schema import AMOUNT_EXPRESSION, PLAN_EXPRESSION
+
+logger = logging.getLogger(__name__)
+
+DAY_FORMAT = "%Y-%m-%d"
+
+SESSION_ROLLUP = "checkout_sessions_daily"
+ROLLUP_MARKER = "_rollup"  # {since, through}: the days [since, through) are rolled up
+# Sessions expire after 24h and the reconciler settles them within 48h
+SESSION_SETTLE = timedelta(days=2)
+
+
+def _day(field: str) -> dict:
+    return {"$dateToString": {"format": DAY_FORMAT, "date": field}}
+
+
+def _midnight(day: date) -> datetime:
+    return datetime.combine(day, dtime.min)
+
+
+def _sessions_pipeline(start: datetime, end: datetime) -> list:
+    return [
+        # Provisional transactions whose Stripe session was never created are not sessions
+        {"$match": {"created_at": {"$gte": start, "$lt": end}, "session_id": {"$type": "string"}}},
+        {"$group": {
+            "_id": {"date": _day("$created_at"), "plan": PLAN_EXPRESSION},
+            "checkout_sessions": {"$sum": 1},
+            "paid_sessions": {"$sum": {"$cond": [{"$eq": ["$payment_status", "paid"]}, 1, 0]}},
+        }},
+    ]
+
+
+async def rollup_checkout_sessions(db, transaction_ttl: timedelta, now: Optional[datetime] = None) -> int:
+    """Store daily session counts for settled days whose transactions have not started expiring.
+
+    Each pass only aggregates the days since the last one; returns the rows written.
+    """
+    now = now or datetime.utcnow()
+    # Transactions created from this day on are all still there
+    first = _midnight((now - transaction_ttl).date() + timedelta(days=1))
+    end = _midnight((now - SESSION_SETTLE).date())
+    marker = await db[SESSION_ROLLUP].find_one({"_id": ROLLUP_MARKER})
+    start = first
+    if marker is not None:
+        if marker["through"] < first:
+            logger.warning("Checkout session rollup fell behind; counts before %s are incomplete", first.date())
+        else:
+            start = marker["through"]
+    if start >= end:
+        return 0
+    operations = [
+        UpdateOne(
+            {"_id": f"{row['_id']['date']}:{row['_id']['plan']}"},
+            {"$set": {
+                "date": row["_id"]["date"], "subscription_plan_id": row["_id"]["plan"],
+                "checkout_sessions": row["checkout_sessions"], "paid_sessions": row["paid_sessions"],
+            }},
+            upsert=True,
+        )
+        async for row in db.payment_transactions.aggregate(_sessions_pipeline(start, end))
+    ]
+    if operations:
+        await db[SESSION_ROLLUP].bulk_write(operations, ordered=False)
+    # A gap (the job was off for longer than the TTL) restarts the covered range
+    since = {"since": start} if marker is None or marker["through"] < first else {}
+    await db[SESSION_ROLLUP].update_one(
+        {"_id": ROLLUP_MARKER}, {"$set": {"through": end, **since}}, upsert=True
+    )
+    return len(operations)
+
+
+def date_range(start: Optional[date], end: Optional[date], default_days: int = 30) -> Tuple[datetime, datetime]:
+    """Half-open [start, end + 1 day) datetime window; defaults to the last ``default_days`` days"""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=default_days - 1)
+    return _midnight(start), _midnight(end + timedelta(days=1))
+
+
+class AnalyticsCache:
+    """Results keyed by query, invalidated by order writes and expired after ``ttl``"""
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self.version = 0
+        self._entries: Dict[Any, Tuple[int, float, Any]] = {}
+
+    def invalidate(self) -> None:
+        self.version += 1
+        self._entries.clear()
+
+    async def get(self, key: Any, compute: Callable) -> Any:
+        entry = self._entries.get(key)
+        if entry and entry[0] == self.version and entry[1] > time.monotonic():
+            return entry[2]
+        version = self.version
+        value = await compute()
+        if version == self.version:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+        return value
+
+
+SESSION_COLUMNS = ["date", "subscription_plan_id", "checkout_sessions", "paid_sessions"]
+
+
+class RevenueAnalytics:
+    def __init__(self, db, plans: Callable[[], list], cache: AnalyticsCache):
+        self.db = db
+        self.plans = plans
+        self.cache = cache
+
+    async def _orders_by_day_and_plan(self, start: datetime, end: datetime) -> pd.DataFrame:
+        """Both order tiers; the archive answers an empty range quickly from its created_at index"""
+        hot, cold = await asyncio.gather(
+            self._orders_in(self.db.orders, start, end), self._orders_in(self.db.orders_archive, start, end)
+        )
+        frame = pd.concat([hot, cold], ignore_index=True)
+        return frame.groupby(["date", "subscription_plan_id"], as_index=False)[["revenue", "orders"]].sum()
+
+    async def _orders_in(self, collection, start: datetime, end: datetime) -> pd.DataFrame:
+        pipeline = [
+            {"$match": {"created_at": {"$gte": start, "$lt": end}, "status": "completed"}},
+            {"$group": {
+                "_id": {"date": _day("$created_at"), "plan": PLAN_EXPRESSION},
+                "revenue": {"$sum": AMOUNT_EXPRESSION},
+                "orders": {"$sum": 1},
+            }},
+        ]
+        rows = [
+            {"date": row["_id"]["date"], "subscription_plan_id": row["_id"]["plan"],
+             "revenue": row["revenue"], "orders": row["orders"]}
+            async for row in collection.aggregate(pipeline)
+        ]
+        return pd.DataFrame(rows, columns=["date", "subscription_plan_id", "revenue", "orders"])
+
+    async def _sessions_by_day_and_plan(self, start: datetime, end: datetime) -> pd.DataFrame:
+        """Rolled-up counts where there are any, live ones for the rest of the window"""
+        live = [(start, end)]
+        frames = []
+        marker = await self.db[SESSION_ROLLUP].find_one({"_id": ROLLUP_MARKER})
+        if marker is not None:
+            rolled_start, rolled_end = max(start, marker["since"]), min(end, marker["through"])
+            if rolled_start < rolled_end:
+                live = [(start, rolled_start), (rolled_end, end)]
+                frames.append(await self._rolled_up_sessions(rolled_start, rolled_end))
+        frames += await asyncio.gather(*[self._live_sessions(a, b) for a, b in live if a < b])
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    async def _rolled_up_sessions(self, start: datetime, end: datetime) -> pd.DataFrame:
+        rows = await self.db[SESSION_ROLLUP].find(
+            {"date": {"$gte": start.strftime(DAY_FORMAT), "$lt": end.strftime(DAY_FORMAT)}},
+            {"_id": 0, "date": 1, "subscription_plan_id": 1, "checkout_sessions": 1, "paid_sessions": 1},
+        ).to_list(None)
+        return pd.DataFrame(rows, columns=SESSION_COLUMNS)
+
+    async def _live_sessions(self, start: datetime, end: datetime) -> pd.DataFrame:
+        rows = [
+            {"date": row["_id"]["date"], "subscription_plan_id": row["_id"]["plan"],
+             "checkout_sessions": row["checkout_sessions"], "paid_sessions": row["paid_sessions"]}
+            async for row in self.db.payment_transactions.aggregate(_sessions_pipeline(start, end))
+        ]
+        return pd.DataFrame(rows, columns=SESSION_COLUMNS)
+
+    async def _combined(self, start: datetime, end: datetime) -> pd.DataFrame:
+        """One row per (day, plan) with revenue, orders, sessions and the plan's service"""
+        orders, sessions = await asyncio.gather(
+            self._orders_by_day_and_plan(start, end), self._sessions_by_day_and_plan(start, end)
+        )
+        frame = orders.merge(sessions, on=["date", "subscription_plan_id"], how="outer")
+        counts = ["orders", "checkout_sessions", "paid_sessions"]
+        frame[counts] = frame[counts].fillna(0).astype(np.int64)
+        frame["revenue"] = frame["revenue"].fillna(0.0).astype(float)
+
+        catalog = pd.DataFrame(self.plans(), columns=["id", "service_name", "plan_name"]) \
+            .rename(columns={"id": "subscription_plan_id"})
+        frame = frame.merge(catalog, on="subscription_plan_id", how="left")
+        frame["service_name"] = frame["service_name"].fillna("Unknown")
+        frame["plan_name"] = frame["plan_name"].fillna(frame["subscription_plan_id"])
+        return frame
+
+    @staticmethod
+    def _rollup(frame: pd.DataFrame, keys: list) -> list:
+        grouped = frame.groupby(keys, as_index=False)[["revenue", "orders", "checkout_sessions", "paid_sessions"]].sum()
+        sessions = grouped["checkout_sessions"].replace(0, np.nan)
+        grouped["conversion_rate"] = (grouped["paid_sessions"] / sessions).fillna(0.0).round(4)
+        grouped["revenue"] = grouped["revenue"].round(2)
+        return grouped.sort_values(keys).to_dict(orient="records")
+
+    @staticmethod
+    def _totals(frame: pd.DataFrame) -> dict:
+        sessions = int(frame["checkout_sessions"].sum())
+        paid = int(frame["paid_sessions"].sum())
+        return {
+            "revenue": round(float(frame["revenue"].sum()), 2),
+            "orders": int(frame["orders"].sum()),
+            "checkout_sessions": sessions,
+            "paid_sessions": paid,
+            "conversion_rate": round(paid / sessions, 4) if sessions else 0.0,
+        }
+
+    async def revenue(self, start: Optional[date], end: Optional[date]) -> dict:
+        window = date_range(start, end)
+
+        async def compute():
+            frame = await self._combined(*window)
+            return {
+                "start": window[0].date().isoformat(),
+                "end": (window[1] - timedelta(days=1)).date().isoformat(),
+                "totals": self._totals(frame),
+                "by_day": self._rollup(frame, ["date"]),
+                "by_plan": self._rollup(frame, ["subscription_plan_id", "service_name", "plan_name"]),
+                "by_service": self._rollup(frame, ["service_name"]),
+            }
+
+        return await self.cache.get(("revenue", window), compute)
+
+    async def plans_summary(self, start: Optional[date], end: Optional[date]) -> list:
+        window = date_range(start, end)
+
+        async def compute():
+            frame = await self._combined(*window)
+            rows = self._rollup(frame, ["subscription_plan_id", "service_name", "plan_name"])
+            for row in rows:
+                row["average_order_value"] = round(row["revenue"] / row["orders"], 2) if row["orders"] else 0.0
+            return rows
+
+        return await self.cache.get(("plans", window), compute)
@@ -0,0 +1,79 @@
+"""Signed access tokens and a bounded in-process cache of user profiles."""
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+
+class TokenService:
+    """Issues and verifies HS256 access tokens carrying the user's id and email"""
+
+    def __init__(self, secret: str, ttl_seconds: int = 3600, algorithm: str = "HS256", issuer: str = "premium-subscription-store"):
+        self.secret = secret
+        self.ttl_seconds = ttl_seconds
+        self.algorithm = algorithm
+        self.issuer = issuer
+
+    @classmethod
+    def from_env(cls) -> "TokenService":
+        secret = os.environ.get('JWT_SECRET')
+        if not secret:
+            # Tokens from one process will not verify in another; set JWT_SECRET for multi-worker deployments
+            logger.warning("JWT_SECRET not set; using a random per-process signing key")
+            secret = secrets.token_urlsafe(32)
+        return cls(secret, ttl_seconds=int(os.environ.get('JWT_TTL_SECONDS', 3600)))
+
+    def issue(self, user: dict) -> str:
+        now = datetime.now(timezone.utc)
+        claims = {
+            "sub": user["id"],
+            "email": user["email"],
+            "iss": self.issuer,
+            "iat": now,
+            "exp": now + timedelta(seconds=self.ttl_seconds),
+        }
+        return jwt.encode(claims, self.secret, algorithm=self.algorithm)
+
+    def verify(self, token: str) -> dict:
+        """Claims of a valid token; raises jwt.InvalidTokenError otherwise"""
+        return jwt.decode(
+            token, self.secret, algorithms=[self.algorithm], issuer=self.issuer,
+            options={"require": ["sub", "email", "exp"]},
+        )
+
+
+class UserCache:
+    """LRU cache of user profiles by id, each entry valid for ``ttl`` seconds"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[Any]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            self._entries.pop(user_id, None)
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: str, user: Any) -> None:
+        self._entries[user_id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
@@ -0,0 +1,209 @@
+"""Subscription catalog served from pre-serialized bytes.
+
+Plans live in the ``subscription_plans`` collection. ``CatalogStore`` keeps
+an immutable ``Catalog`` snapshot in memory and swaps in a new one whenever
+the collection changes: through a change stream where the deployment
+supports one, otherwise by polling a version counter that every write
+through the store increments.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Type
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+CATALOG_MEDIA_TYPE = "application/json"
+CATALOG_CACHE_CONTROL = "public, no-cache"
+CATALOG_VERSION_ID = "subscription_plans"
+
+
+class CatalogEntry(NamedTuple):
+    plan: dict
+    body: bytes
+    etag: str
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the response bytes"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any((tag[2:] if tag.startswith("W/") else tag) == opaque for tag in candidates)
+
+
+class Catalog:
+    """Id-indexed plans plus the list and per-plan JSON bodies, serialized once"""
+
+    def __init__(self, plans: Iterable[dict], model: Type[BaseModel]):
+        validated = [model(**plan) for plan in plans]
+        self._entries: Dict[str, CatalogEntry] = {}
+        for plan in validated:
+            body = plan.model_dump_json().encode()
+            self._entries[plan.id] = CatalogEntry(plan.model_dump(), body, make_etag(body))
+        self.list_body = b"[" + b",".join(entry.body for entry in self._entries.values()) + b"]"
+        self.list_etag = make_etag(self.list_body)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_entry(self, plan_id: str) -> Optional[CatalogEntry]:
+        return self._entries.get(plan_id)
+
+    def get_plan(self, plan_id: str) -> Optional[dict]:
+        """Plan dict by id, or None if the plan does not exist"""
+        entry = self._entries.get(plan_id)
+        return entry.plan if entry else None
+
+    def plans(self) -> List[dict]:
+        return [entry.plan for entry in self._entries.values()]
+
+
+class CatalogStore:
+    """Mongo-backed catalog; readers get the current snapshot without any I/O"""
+
+    def __init__(
+        self,
+        db,
+        model: Type[BaseModel],
+        seed_plans: Iterable[dict],
+        poll_interval: float = 5.0,
+        on_change: Optional[Callable[[], None]] = None,
+    ):
+        self.plans_collection = db.subscription_plans
+        self.versions = db.catalog_versions
+        self.model = model
+        self.seed_plans = list(seed_plans)
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        # Serve the seed plans until the first load from MongoDB
+        self.current = Catalog(self.seed_plans, model)
+        self.version: Optional[int] = None
+        self.mode: Optional[str] = None  # "change_stream" or "poll" once running
+        self._task: Optional[asyncio.Task] = None
+
+    def get_entry(self, plan_id: str) -> Optional[CatalogEntry]:
+        return self.current.get_entry(plan_id)
+
+    def get_plan(self, plan_id: str) -> Optional[dict]:
+        return self.current.get_plan(plan_id)
+
+    def plans(self) -> List[dict]:
+        return self.current.plans()
+
+    async def seed(self) -> None:
+        """Insert the built-in plans into an empty collection; safe to race across workers"""
+        if await self.plans_collection.count_documents({}, limit=1) == 0:
+            await self.plans_collection.bulk_write([
+                UpdateOne({"id": plan["id"]}, {"$setOnInsert": self.model(**plan).model_dump()}, upsert=True)
+                for plan in self.seed_plans
+            ], ordered=False)
+        await self.versions.update_one(
+            {"_id": CATALOG_VERSION_ID}, {"$setOnInsert": {"version": 0}}, upsert=True
+        )
+
+    async def refresh(self) -> None:
+        """Load every plan and atomically replace the snapshot"""
+        # Read the version first: a write racing the load bumps it again and is picked up next time
+        version_doc = await self.versions.find_one({"_id": CATALOG_VERSION_ID})
+        plans = await self.plans_collection.find({}, {"_id": 0}).sort("_id", 1).to_list(None)
+        self.current = Catalog(plans, self.model)
+        self.version = version_doc["version"] if version_doc else None
+        if self.on_change is not None:
+            self.on_change()
+
+    async def _bump_version(self) -> None:
+        await self.versions.update_one({"_id": CATALOG_VERSION_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+    async def save_plan(self, plan: dict) -> dict:
+        """Create or replace a plan and publish it to every worker"""
+        document = self.model(**plan).model_dump()
+        await self.plans_collection.update_one({"id": document["id"]}, {"$set": document}, upsert=True)
+        await self._bump_version()
+        await self.refresh()
+        return self.current.get_plan(document["id"])
+
+    async def update_plan(self, plan_id: str, changes: dict) -> Optional[dict]:
+        """Apply a partial update to a plan; None if the plan does not exist.
+
+        Raises ``ValidationError`` if the result would not be a valid plan.
+        Only the changed fields are written, so concurrent updates to other
+        fields are not lost.
+        """
+        existing = await self.plans_collection.find_one({"id": plan_id}, {"_id": 0})
+        if existing is None:
+            return None
+        document = self.model(**{**existing, **changes, "id": plan_id}).model_dump()
+        result = await self.plans_collection.update_one(
+            {"id": plan_id}, {"$set": {field: document[field] for field in changes if field != "id"}}
+        )
+        if result.matched_count == 0:
+            return None
+        await self._bump_version()
+        await self.refresh()
+        return self.current.get_plan(plan_id)
+
+    async def _watch(self) -> None:
+        async with self.plans_collection.watch() as stream:
+            self.mode = "change_stream"
+            # Changes made while the stream was (re)opening would otherwise be missed
+            await self.refresh()
+            async for _ in stream:
+                await self.refresh()
+
+    async def _poll(self) -> None:
+        self.mode = "poll"
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                version_doc = await self.versions.find_one({"_id": CATALOG_VERSION_ID})
+                if version_doc and version_doc.get("version") != self.version:
+                    await self.refresh()
+            except Exception as e:
+                logger.error("Catalog version poll failed: %s", e)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self._watch()
+            except Exception as e:
+                if self.mode != "change_stream":
+                    # Standalone servers have no change streams (OperationFailure 40573)
+                    logger.info("Catalog change stream unavailable (%s); polling the version counter", e)
+                    await self._poll()
+                logger.error("Catalog change stream failed, reopening: %s", e)
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self) -> None:
+        await self.seed()
+        await self.refresh()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def cached_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve pre-serialized bytes, or a bare 304 if the client already has them"""
+    headers = {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=CATALOG_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,66 @@
+"""In-process fan-out of checkout status changes to Server-Sent Event streams.
+
+Whatever records a status change (the webhook inbox, the reconciler, or a
+Stripe refresh) publishes the session id. Every stream watching that
+session shares one ``asyncio.Event``, so one publish is one wakeup no
+matter how many tabs are open. Publishing only reaches streams in the same
+worker; streams also recheck the database on a timer, so a change recorded
+by another worker is picked up on the next recheck.
+"""
+import asyncio
+import json
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+class _Channel:
+    __slots__ = ("event", "subscribers")
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.subscribers = 0
+
+
+class CheckoutEventHub:
+    """Per-session wakeups shared by every subscriber of that session"""
+
+    def __init__(self):
+        self._channels: Dict[str, _Channel] = {}
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def subscribers(self) -> int:
+        return sum(channel.subscribers for channel in self._channels.values())
+
+    def publish(self, session_id: str) -> None:
+        channel = self._channels.get(session_id)
+        if channel is not None:
+            # Wake everyone waiting on the current event; later waits use a fresh one
+            event, channel.event = channel.event, asyncio.Event()
+            event.set()
+
+    def wake_all(self) -> None:
+        for session_id in list(self._channels):
+            self.publish(session_id)
+
+    @contextmanager
+    def subscribe(self, session_id: str) -> Iterator[_Channel]:
+        """Channel for a session. Take ``channel.event`` *before* reading state, then wait on it"""
+        channel = self._channels.get(session_id)
+        if channel is None:
+            channel = self._channels[session_id] = _Channel()
+        channel.subscribers += 1
+        try:
+            yield channel
+        finally:
+            channel.subscribers -= 1
+            if channel.subscribers == 0:
+                self._channels.pop(session_id, None)
+
+
+def sse_event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+SSE_KEEPALIVE = b": keepalive\n\n"
@@ -0,0 +1,97 @@
+"""Checkout session creation with the database write taken off the critical path.
+
+The payment transaction is inserted as a *provisional* row (no session id,
+``provisional_at`` set) while Stripe creates the session, so the client
+waits for the slower of the two instead of both back to back. The row's id
+travels to Stripe in the session metadata as ``transaction_id``. Once Stripe
+answers, the response goes out and a background task stamps the session id
+onto the row.
+
+Until that finalization lands, lookups by session id in this worker wait
+for it, and the webhook inbox can find the row through ``transaction_id``.
+A failed Stripe call deletes its row straight away; rows left behind by a
+crash keep ``provisional_at`` and are removed by a TTL index.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Set, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TRANSACTION_ID_KEY = "transaction_id"
+
+
+class CheckoutPipeline:
+    """Overlaps the provisional transaction insert with the Stripe call"""
+
+    def __init__(self, db, finalize_attempts: int = 5, retry_base_delay: float = 0.05):
+        self.collection = db.payment_transactions
+        self.finalize_attempts = finalize_attempts
+        self.retry_base_delay = retry_base_delay
+        self._finalizing: Dict[str, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.ensure_future(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def pending(self) -> int:
+        return len(self._finalizing)
+
+    async def create(self, transaction: dict, create_session: Callable[[], Awaitable[T]]) -> T:
+        """Insert ``transaction`` provisionally while ``create_session`` runs; returns the session.
+
+        ``transaction`` must carry ``id`` and ``provisional_at``, and no session id.
+        """
+        insert = asyncio.ensure_future(self.collection.insert_one(transaction))
+        try:
+            session = await create_session()
+        except BaseException:
+            self._spawn(self._discard(insert, transaction["id"]))
+            raise
+        # Normally long done: the insert is one local round trip, Stripe is several remote ones
+        await insert
+        task = self._spawn(self._finalize(transaction["id"], session.session_id))
+        self._finalizing[session.session_id] = task
+        task.add_done_callback(lambda done: self._finalizing.pop(session.session_id, None))
+        return session
+
+    async def _discard(self, insert: asyncio.Future, transaction_id: str) -> None:
+        try:
+            await insert
+            await self.collection.delete_one({"id": transaction_id, "session_id": None})
+        except Exception as e:
+            logger.warning("Could not discard provisional transaction %s: %s", transaction_id, e)
+
+    async def _finalize(self, transaction_id: str, session_id: str) -> None:
+        for attempt in range(self.finalize_attempts):
+            try:
+                await self.collection.update_one(
+                    {"id": transaction_id},
+                    {"$set": {"session_id": session_id, "updated_at": datetime.utcnow()},
+                     "$unset": {"provisional_at": ""}},
+                )
+                return
+            except Exception as e:
+                logger.warning("Finalizing transaction %s failed (attempt %d): %s", transaction_id, attempt + 1, e)
+                await asyncio.sleep(random.uniform(0, self.retry_base_delay * 2 ** attempt))
+        logger.error("Gave up finalizing transaction %s for session %s", transaction_id, session_id)
+
+    async def wait_finalized(self, session_id: str) -> bool:
+        """Wait for this worker's pending finalization of ``session_id``; False if there is none"""
+        task: Optional[asyncio.Task] = self._finalizing.get(session_id)
+        if task is None:
+            return False
+        await asyncio.shield(task)
+        return True
+
+    async def stop(self) -> None:
+        """Let pending finalizations and discards finish"""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
@@ -0,0 +1,87 @@
+"""In-memory stand-in for StripeCheckout, used by the load-test harness.
+
+Sessions live in a process-wide dict. Each call sleeps for a configurable
+latency to model the remote round trip. Webhook bodies are plain JSON with
+the fields of a processed event, and no signature is checked.
+"""
+import asyncio
+import json
+import random
+import uuid
+from typing import Dict, NamedTuple, Optional
+
+
+class FakeSession(NamedTuple):
+    url: str
+    session_id: str
+
+
+class FakeStatus(NamedTuple):
+    status: str
+    payment_status: str
+    amount_total: int
+    currency: str
+    metadata: Dict[str, str]
+
+
+class FakeWebhookEvent(NamedTuple):
+    event_type: str
+    event_id: str
+    session_id: str
+    payment_status: str
+    metadata: Dict[str, str]
+
+
+class FakeStripeCheckout:
+    """Drop-in for emergentintegrations' StripeCheckout with simulated latency"""
+
+    latency: float = 0.08  # seconds per remote call
+    jitter: float = 0.2  # +/- fraction of latency
+    sessions: Dict[str, dict] = {}
+
+    def __init__(self, api_key: str, webhook_url: Optional[str] = None, webhook_secret: Optional[str] = None):
+        self.api_key = api_key
+        self.webhook_url = webhook_url
+
+    @classmethod
+    async def _round_trip(cls) -> None:
+        if cls.latency > 0:
+            await asyncio.sleep(cls.latency * random.uniform(1 - cls.jitter, 1 + cls.jitter))
+
+    @classmethod
+    def mark_paid(cls, session_id: str) -> None:
+        cls.sessions[session_id].update(status="complete", payment_status="paid")
+
+    async def create_checkout_session(self, checkout_request) -> FakeSession:
+        await self._round_trip()
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        FakeStripeCheckout.sessions[session_id] = {
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": int(round(checkout_request.amount * 100)),
+            "currency": checkout_request.currency,
+            "metadata": dict(checkout_request.metadata or {}),
+        }
+        return FakeSession(url=f"https://checkout.stripe.test/pay/{session_id}", session_id=session_id)
+
+    async def get_checkout_status(self, checkout_session_id: str) -> FakeStatus:
+        await self._round_trip()
+        session = FakeStripeCheckout.sessions.get(checkout_session_id)
+        if session is None:
+            raise ValueError(f"No such checkout session: {checkout_session_id}")
+        return FakeStatus(**session)
+
+    async def handle_webhook(self, webhook_payload: bytes, signature: Optional[str]) -> FakeWebhookEvent:
+        event = json.loads(webhook_payload)
+        session_id = event["session_id"]
+        payment_status = event.get("payment_status", "paid")
+        if payment_status == "paid" and session_id in FakeStripeCheckout.sessions:
+            FakeStripeCheckout.mark_paid(session_id)
+        return FakeWebhookEvent(
+            event_type=event.get("event_type", "checkout.session.completed"),
+            event_id=event.get("event_id") or f"evt_{uuid.uuid4().hex}",
+            session_id=session_id,
+            payment_status=payment_status,
+            # Like Stripe, events carry the metadata the session was created with
+            metadata=event.get("metadata") or FakeStripeCheckout.sessions.get(session_id, {}).get("metadata", {}),
+        )
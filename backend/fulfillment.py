@@ -0,0 +1,94 @@
+"""Shared, idempotent payment-status recording and order materialization.
+
+A paid checkout session maps to exactly one order: orders are upserted on
+``payment_session_id``, which carries a unique index, so a webhook and a
+status poll racing on the same session cannot both create one. Paid is a
+one-way state: every other status update is conditional on the transaction
+not being paid yet, so a stale poll or an out-of-order event cannot undo it.
+"""
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class OrderFulfillment:
+    """Applies payment status changes and creates the matching order once"""
+
+    def __init__(
+        self,
+        db,
+        build_order: Callable[[dict, str], dict],
+        on_orders_created: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+    ):
+        self.db = db
+        self.build_order = build_order
+        self.on_orders_created = on_orders_created
+
+    @staticmethod
+    def status_filter(payment_status: str) -> dict:
+        """Extra filter for a status update, so that it never overwrites a recorded payment"""
+        return {} if payment_status == "paid" else {"payment_status": {"$ne": "paid"}}
+
+    @staticmethod
+    def status_update(payment_status: str, status: Optional[str] = None, now: Optional[datetime] = None) -> dict:
+        fields = {"payment_status": payment_status, "updated_at": now or datetime.utcnow()}
+        if status is not None:
+            fields["status"] = status
+        if payment_status == "paid":
+            # Paid transactions are kept; only abandoned ones expire
+            return {"$set": fields, "$unset": {"expires_at": ""}}
+        return {"$set": fields}
+
+    async def materialize_orders(self, payment_transactions: List[dict]) -> List[dict]:
+        """Create the orders for paid transactions in one bulk upsert; returns the new ones"""
+        built = {}
+        for payment_transaction in payment_transactions:
+            session_id = payment_transaction["session_id"]
+            built[session_id] = self.build_order(payment_transaction, session_id)
+        if not built:
+            return []
+        operations = [
+            UpdateOne({"payment_session_id": session_id}, {"$setOnInsert": order}, upsert=True)
+            for session_id, order in built.items()
+        ]
+        try:
+            result = await self.db.orders.bulk_write(operations, ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # Concurrent upserts that both missed: the other one inserted the order
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+            upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+
+        orders = list(built.values())
+        created = [orders[index] for index in sorted(upserted)]
+        if created and self.on_orders_created is not None:
+            try:
+                await self.on_orders_created(created)
+            except Exception as e:
+                logger.error("Order created hook failed for %d orders: %s", len(created), e)
+        return created
+
+    async def apply_status(
+        self, session_id: str, payment_status: str, status: Optional[str] = None
+    ) -> Optional[dict]:
+        """Record a session's status and, if paid, its order: two round trips at most.
+
+        Returns the updated transaction, or None for an unknown session or an
+        already paid one.
+        """
+        payment_transaction = await self.db.payment_transactions.find_one_and_update(
+            {"session_id": session_id, **self.status_filter(payment_status)},
+            self.status_update(payment_status, status),
+            return_document=ReturnDocument.AFTER,
+        )
+        if payment_transaction and payment_status == "paid":
+            await self.materialize_orders([payment_transaction])
+        return payment_transaction
@@ -0,0 +1,187 @@
+"""Idempotency-Key handling for POST endpoints that create things.
+
+The first request with a key runs. Its response bytes and headers are stored in the
+``idempotency_keys`` collection (TTL-indexed on ``created_at``) and in a
+per-process LRU in front of it, and any replay gets those exact bytes back
+until the key is ``ttl`` old.
+Concurrent duplicates wait for the first request instead of running
+themselves: in-process through a shared task, across workers by polling the
+``in_progress`` record. Failures (exceptions and 5xx responses) release the
+key so the client can retry for real.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Response
+from pymongo.errors import DuplicateKeyError
+
+from indexes import IDEMPOTENCY_KEY_TTL
+from serialization import dumps
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# Recomputed for every response, or only meaningful for one connection
+UNSTORED_HEADERS = {
+    "connection", "content-length", "content-type", "keep-alive", "proxy-connection", "te", "trailer",
+    "transfer-encoding", "upgrade",
+}
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: bytes
+    media_type: str
+    headers: Dict[str, str]
+
+    @classmethod
+    def from_response(cls, request_fingerprint: str, response: Response) -> "StoredResponse":
+        headers = {name: value for name, value in response.headers.items() if name not in UNSTORED_HEADERS}
+        return cls(request_fingerprint, response.status_code, bytes(response.body), response.media_type, headers)
+
+    def replay(self) -> Response:
+        return Response(
+            content=self.body, status_code=self.status_code, media_type=self.media_type,
+            headers={**self.headers, REPLAY_HEADER: "true"},
+        )
+
+
+def fingerprint(payload: dict) -> str:
+    """Hash of the request payload, so a key reused for a different request is caught"""
+    return hashlib.sha256(dumps(payload)).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        db,
+        max_entries: int = 10000,
+        lock_timeout: float = 30.0,
+        poll_interval: float = 0.1,
+        ttl: float = IDEMPOTENCY_KEY_TTL,
+    ):
+        self.collection = db.idempotency_keys
+        self.max_entries = max_entries
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        # Response and when its key expires, on the same clock as the TTL index
+        self._responses: "OrderedDict[str, Tuple[StoredResponse, datetime]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.replays = 0
+
+    def _remember(self, record_id: str, stored: StoredResponse, created_at: datetime) -> None:
+        self._responses[record_id] = (stored, created_at + timedelta(seconds=self.ttl))
+        self._responses.move_to_end(record_id)
+        while len(self._responses) > self.max_entries:
+            self._responses.popitem(last=False)
+
+    @staticmethod
+    def _check(stored: StoredResponse, request_fingerprint: str) -> Response:
+        if stored.fingerprint != request_fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        return stored.replay()
+
+    async def run(
+        self, scope: str, key: str, payload: dict, handler: Callable[[], Awaitable[Response]]
+    ) -> Response:
+        """Run ``handler`` once per (scope, key); replays get the first response's bytes"""
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+        record_id = f"{scope}:{key}"
+        request_fingerprint = fingerprint(payload)
+
+        cached = self._responses.get(record_id)
+        if cached is not None:
+            stored, expires_at = cached
+            if expires_at > datetime.utcnow():
+                self._responses.move_to_end(record_id)
+                self.replays += 1
+                return self._check(stored, request_fingerprint)
+            del self._responses[record_id]
+
+        task = self._inflight.get(record_id)
+        first = task is None
+        if first:
+            task = asyncio.ensure_future(self._execute(record_id, request_fingerprint, handler))
+            self._inflight[record_id] = task
+            task.add_done_callback(lambda done: self._inflight.pop(record_id, None))
+        # The first caller disconnecting must not abandon the work the others wait on
+        stored, response = await asyncio.shield(task)
+        if first and response is not None:
+            return response
+        self.replays += 1
+        return self._check(stored, request_fingerprint)
+
+    async def _claim(self, record_id: str, request_fingerprint: str) -> Optional[StoredResponse]:
+        """Take the key, or return the stored response once whoever holds it finishes"""
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            now = datetime.utcnow()
+            try:
+                await self.collection.insert_one({
+                    "_id": record_id, "fingerprint": request_fingerprint, "status": IN_PROGRESS, "created_at": now,
+                })
+                return None
+            except DuplicateKeyError:
+                pass
+            record = await self.collection.find_one({"_id": record_id})
+            if record is None:
+                continue  # released (or expired) meanwhile; try again
+            if record["status"] == DONE and record["created_at"] < now - timedelta(seconds=self.ttl):
+                # Expired but not yet removed by the TTL monitor: treat the key as unused
+                await self.collection.delete_one({"_id": record_id, "created_at": record["created_at"]})
+                continue
+            if record["status"] == DONE:
+                stored = StoredResponse(
+                    record["fingerprint"], record["status_code"], bytes(record["body"]), record["media_type"],
+                    record.get("headers", {}),
+                )
+                self._remember(record_id, stored, record["created_at"])
+                return stored
+            # Held by a request that died mid-flight: take it over
+            taken = await self.collection.find_one_and_update(
+                {"_id": record_id, "status": IN_PROGRESS, "created_at": {"$lt": now - timedelta(seconds=self.lock_timeout)}},
+                {"$set": {"fingerprint": request_fingerprint, "created_at": now}},
+            )
+            if taken is not None:
+                return None
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "1"},
+                )
+            await asyncio.sleep(self.poll_interval)
+
+    async def _execute(
+        self, record_id: str, request_fingerprint: str, handler
+    ) -> Tuple[StoredResponse, Optional[Response]]:
+        """The stored response, and the handler's own unless it came from an earlier request"""
+        claimed_at = datetime.utcnow()  # no later than the record's created_at
+        stored = await self._claim(record_id, request_fingerprint)
+        if stored is not None:
+            return stored, None
+        try:
+            response = await handler()
+        except BaseException:
+            await self.collection.delete_one({"_id": record_id, "status": IN_PROGRESS})
+            raise
+        stored = StoredResponse.from_response(request_fingerprint, response)
+        if response.status_code >= 500:
+            await self.collection.delete_one({"_id": record_id, "status": IN_PROGRESS})
+            return stored, response
+        await self.collection.update_one({"_id": record_id}, {"$set": {
+            "status": DONE,
+            "status_code": stored.status_code,
+            "body": stored.body,
+            "media_type": stored.media_type,
+            "headers": stored.headers,
+        }})
+        self._remember(record_id, stored, claimed_at)
+        return stored, response
@@ -0,0 +1,246 @@
+"""MongoDB index declarations, idempotent provisioning and query-plan checks.
+
+Run ``python indexes.py ensure`` to create the indexes, or
+``python indexes.py check`` to explain every hot query shape and fail on a
+collection scan.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Matches any non-empty string, so documents with a null/missing id are left
+# out of the unique index while equality lookups can still use it.
+HAS_STRING_ID = {"$gt": ""}
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    name: str
+    unique: bool = False
+    partial: Optional[dict] = None
+    expire_after: Optional[int] = None  # seconds, for TTL indexes
+
+    def options(self) -> dict:
+        options = {"name": self.name, "unique": self.unique}
+        if self.partial:
+            options["partialFilterExpression"] = self.partial
+        if self.expire_after is not None:
+            options["expireAfterSeconds"] = self.expire_after
+        return options
+
+
+class QueryShape(NamedTuple):
+    collection: str
+    filter: dict
+    description: str
+    sort: Optional[List[Tuple[str, int]]] = None
+
+
+REQUIRED_INDEXES = [
+    IndexSpec("users", [("email", ASCENDING)], "users_email_unique", unique=True),
+    IndexSpec("users", [("id", ASCENDING)], "users_id_unique", unique=True),
+    IndexSpec("subscription_plans", [("id", ASCENDING)], "subscription_plans_id_unique", unique=True),
+    IndexSpec("orders", [("id", ASCENDING)], "orders_id_unique", unique=True),
+    IndexSpec(
+        "orders", [("user_email", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+        "orders_user_email_keyset",
+    ),
+    IndexSpec("orders", [("created_at", DESCENDING), ("id", DESCENDING)], "orders_keyset"),
+    IndexSpec(
+        "orders", [("payment_session_id", ASCENDING)], "orders_payment_session_unique",
+        unique=True, partial={"payment_session_id": HAS_STRING_ID},
+    ),
+    # The cold tier is read the same ways as orders
+    IndexSpec("orders_archive", [("id", ASCENDING)], "orders_archive_id_unique", unique=True),
+    IndexSpec(
+        "orders_archive", [("user_email", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+        "orders_archive_user_email_keyset",
+    ),
+    IndexSpec("orders_archive", [("created_at", DESCENDING), ("id", DESCENDING)], "orders_archive_keyset"),
+    IndexSpec(
+        "payment_transactions", [("session_id", ASCENDING)], "payment_transactions_session_unique",
+        unique=True, partial={"session_id": HAS_STRING_ID},
+    ),
+    IndexSpec("payment_transactions", [("id", ASCENDING)], "payment_transactions_id_unique", unique=True),
+    IndexSpec("payment_transactions", [("created_at", ASCENDING)], "payment_transactions_created_at"),
+    # Provisional transactions outlive the Stripe session (24h by default) so a
+    # late webhook can still adopt one; past that they are crash leftovers
+    IndexSpec(
+        "payment_transactions", [("provisional_at", ASCENDING)], "payment_transactions_provisional_ttl",
+        expire_after=25 * 3600,
+    ),
+    # Unpaid transactions carry their own deletion time; paying clears it
+    IndexSpec(
+        "payment_transactions", [("expires_at", ASCENDING)], "payment_transactions_expires_ttl", expire_after=0,
+    ),
+    IndexSpec(
+        "payment_transactions", [("payment_status", ASCENDING), ("created_at", ASCENDING)],
+        "payment_transactions_reconcile",
+    ),
+    # Analytics session counts that outlive the expiring transactions
+    IndexSpec("checkout_sessions_daily", [("date", ASCENDING)], "checkout_sessions_daily_date"),
+    IndexSpec("webhook_events", [("event_id", ASCENDING)], "webhook_events_event_id_unique", unique=True),
+    IndexSpec("webhook_events", [("status", ASCENDING), ("received_at", ASCENDING)], "webhook_events_queue"),
+    # Processed events are kept for a week so Stripe's retries are still deduplicated
+    IndexSpec(
+        "webhook_events", [("processed_at", ASCENDING)], "webhook_events_processed_ttl",
+        expire_after=7 * 24 * 3600,
+    ),
+    IndexSpec("email_outbox", [("status", ASCENDING), ("next_attempt_at", ASCENDING)], "email_outbox_queue"),
+    IndexSpec("email_outbox", [("sent_at", ASCENDING)], "email_outbox_sent_ttl", expire_after=30 * 24 * 3600),
+    # Idempotency keys are honoured for a day, like Stripe's own
+    IndexSpec("idempotency_keys", [("created_at", ASCENDING)], "idempotency_keys_ttl", expire_after=IDEMPOTENCY_KEY_TTL),
+]
+
+QUERY_SHAPES = [
+    QueryShape("users", {"email": "probe@example.com"}, "create_user/login by email"),
+    QueryShape("users", {"id": "probe"}, "password rehash by id"),
+    QueryShape("orders", {"id": "probe"}, "get_order by id"),
+    QueryShape(
+        "orders", {"user_email": "probe@example.com"}, "get_orders by user",
+        sort=[("created_at", DESCENDING), ("id", DESCENDING)],
+    ),
+    QueryShape(
+        "orders", {}, "get_orders, all users",
+        sort=[("created_at", DESCENDING), ("id", DESCENDING)],
+    ),
+    QueryShape("orders", {"payment_session_id": "cs_probe"}, "order by payment session"),
+    QueryShape(
+        "orders", {"created_at": {"$lt": datetime(2000, 1, 1)}}, "orders due for archiving",
+        sort=[("created_at", ASCENDING)],
+    ),
+    QueryShape("orders_archive", {"id": "probe"}, "get_order archive fall-through"),
+    QueryShape(
+        "orders_archive", {"user_email": "probe@example.com"}, "get_orders by user, archive tier",
+        sort=[("created_at", DESCENDING), ("id", DESCENDING)],
+    ),
+    QueryShape("payment_transactions", {"session_id": "cs_probe"}, "transaction by session"),
+    QueryShape("payment_transactions", {"id": "probe"}, "provisional transaction by id"),
+    QueryShape(
+        "payment_transactions",
+        {"payment_status": {"$in": ["pending", "unpaid"]}, "created_at": {"$lt": datetime(2000, 1, 1)}},
+        "reconciler stale transactions", sort=[("created_at", ASCENDING)],
+    ),
+    QueryShape(
+        "payment_transactions", {"payment_status": "paid", "created_at": {"$gt": datetime(2000, 1, 1)}},
+        "reconciler paid transactions", sort=[("created_at", ASCENDING)],
+    ),
+    QueryShape("webhook_events", {"status": "pending"}, "webhook inbox queue", sort=[("received_at", ASCENDING)]),
+    QueryShape("email_outbox", {"status": "pending"}, "email outbox queue", sort=[("next_attempt_at", ASCENDING)]),
+]
+
+
+async def ensure_indexes(db, specs: List[IndexSpec] = REQUIRED_INDEXES) -> List[IndexSpec]:
+    """Create every declared index; a no-op for indexes that already exist.
+
+    One index failing (e.g. a unique index over existing duplicates) does not
+    stop the others from being built; returns the ones that failed.
+    """
+    failed = []
+    for spec in specs:
+        try:
+            await db[spec.collection].create_index(spec.keys, **spec.options())
+        except OperationFailure as e:
+            logger.error("Creating index %s on %s failed: %s", spec.name, spec.collection, e)
+            failed.append(spec)
+    return failed
+
+
+async def missing_indexes(db, specs: List[IndexSpec] = REQUIRED_INDEXES) -> List[IndexSpec]:
+    """Declared indexes that are absent or whose keys/options differ"""
+    missing = []
+    existing: Dict[str, dict] = {}
+    for spec in specs:
+        if spec.collection not in existing:
+            existing[spec.collection] = await db[spec.collection].index_information()
+        info = existing[spec.collection].get(spec.name)
+        if (
+            info is None
+            or [(field, int(direction)) for field, direction in info["key"]] != spec.keys
+            or bool(info.get("unique")) != spec.unique
+            or info.get("partialFilterExpression") != spec.partial
+            or info.get("expireAfterSeconds") != spec.expire_after
+        ):
+            missing.append(spec)
+    return missing
+
+
+async def provision_indexes(db) -> List[IndexSpec]:
+    """Startup step: create indexes, then return whatever is still missing"""
+    await ensure_indexes(db)
+    missing = await missing_indexes(db)
+    for spec in missing:
+        logger.error("Missing index %s on %s", spec.name, spec.collection)
+    return missing
+
+
+def plan_stages(plan) -> List[str]:
+    """All stage names in an explain() plan tree, classic or SBE"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+async def explain_query_shapes(db, shapes: List[QueryShape] = QUERY_SHAPES) -> List[dict]:
+    """Explain each hot query shape and report whether it is index-backed"""
+    report = []
+    for shape in shapes:
+        cursor = db[shape.collection].find(shape.filter)
+        if shape.sort:
+            cursor = cursor.sort(shape.sort)
+        explain = await cursor.explain()
+        stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        report.append({
+            "collection": shape.collection,
+            "query": shape.description,
+            "stages": stages,
+            "indexed": "COLLSCAN" not in stages,
+        })
+    return report
+
+
+async def _main(command: str) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if command == "ensure":
+            missing = await provision_indexes(db)
+            print(f"{len(REQUIRED_INDEXES) - len(missing)}/{len(REQUIRED_INDEXES)} indexes present")
+            return 1 if missing else 0
+        report = await explain_query_shapes(db)
+        for row in report:
+            status = "OK  " if row["indexed"] else "SCAN"
+            print(f"{status} {row['collection']:<22} {row['query']:<32} {' > '.join(row['stages'])}")
+        return 0 if all(row["indexed"] for row in report) else 1
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["ensure", "check"])
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_main(args.command)))
@@ -0,0 +1,459 @@
+"""Local load-test and benchmark harness for the backend API.
+
+Boots ``server.app`` in-process over ASGI (no sockets) against a local
+MongoDB or mongomock-motor, with FakeStripeCheckout standing in for Stripe.
+It then runs concurrent scenarios and prints per-route throughput and
+p50/p95/p99 latency as JSON, so runs from two commits can be compared:
+
+    python loadtest.py run --mongo mock --duration 5 --concurrency 16 > before.json
+    python loadtest.py run --mongo mongodb://localhost:27017 > after.json
+    python loadtest.py compare before.json after.json
+
+To exercise read routing, start a local three-member replica set and point a
+run at it with reads sent to secondaries:
+
+    python loadtest.py replica-set > rs-url.txt   # runs until Ctrl-C
+    python loadtest.py run --mongo "$(cat rs-url.txt)" --read-preference secondaryPreferred
+
+The ``read_your_writes`` scenario then counts every order that could not be
+read back with the token from its creation as an error.
+
+``python loadtest.py serialization`` times encoding one page of orders the
+old way (model per document, response_model re-validation, JSON encoder)
+against the projected-document orjson path the API now uses.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from fake_stripe import FakeStripeCheckout
+
+ROOT_DIR = Path(__file__).parent
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Latency samples and error counts per route template"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, method: str, url: str, route: str,
+                   expect=(200,), **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples[route].append((time.perf_counter() - start) * 1000)
+        if response.status_code not in expect:
+            self.errors[route] += 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        routes = {}
+        for route, values in sorted(self.samples.items()):
+            values.sort()
+            routes[route] = {
+                "count": len(values),
+                "errors": self.errors.get(route, 0),
+                "throughput_rps": round(len(values) / elapsed, 1),
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": round(percentile(values, 50), 3),
+                "p95_ms": round(percentile(values, 95), 3),
+                "p99_ms": round(percentile(values, 99), 3),
+                "max_ms": round(values[-1], 3),
+            }
+        total = sum(len(values) for values in self.samples.values())
+        return {
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(total / elapsed, 1),
+            "routes": routes,
+        }
+
+
+def read_token(response: httpx.Response) -> Dict[str, str]:
+    """Headers echoing a response's read token, as the frontend does"""
+    token = response.headers.get("x-read-token")
+    return {"X-Read-Token": token} if token else {}
+
+
+def checkout_body(plan_id: str, email: Optional[str] = None) -> dict:
+    return {
+        "subscription_plan_id": plan_id,
+        "user_email": email or f"load_{uuid.uuid4().hex[:10]}@example.com",
+        "origin_url": "http://loadtest.local",
+    }
+
+
+class Scenarios:
+    """Each scenario has an optional setup and an iteration run repeatedly by every worker"""
+
+    def __init__(self, client: httpx.AsyncClient, plan_ids: List[str]):
+        self.client = client
+        self.plan_ids = plan_ids
+        self.sessions: List[str] = []
+
+    async def _create_sessions(self, rec: Recorder, count: int) -> List[str]:
+        sessions = []
+        for _ in range(count):
+            response = await rec.call(
+                self.client, "POST", "/api/checkout/session", "POST /api/checkout/session",
+                json=checkout_body(random.choice(self.plan_ids)),
+            )
+            sessions.append(response.json()["session_id"])
+        return sessions
+
+    async def catalog(self, rec: Recorder, state: dict) -> None:
+        headers = {"If-None-Match": state["etag"]} if state.get("etag") and random.random() < 0.5 else {}
+        response = await rec.call(
+            self.client, "GET", "/api/subscriptions", "GET /api/subscriptions", expect=(200, 304), headers=headers
+        )
+        state["etag"] = response.headers.get("etag")
+        await rec.call(
+            self.client, "GET", f"/api/subscriptions/{random.choice(self.plan_ids)}",
+            "GET /api/subscriptions/{subscription_id}",
+        )
+
+    async def auth(self, rec: Recorder, state: dict) -> None:
+        email = f"load_{uuid.uuid4().hex}@example.com"
+        password = "load-test-password"
+        response = await rec.call(self.client, "POST", "/api/users", "POST /api/users", json={
+            "email": email, "first_name": "Load", "last_name": "Test", "password": password,
+        })
+        await rec.call(self.client, "POST", "/api/auth/login", "POST /api/auth/login",
+                       json={"email": email, "password": password}, headers=read_token(response))
+
+    async def checkout(self, rec: Recorder, state: dict) -> None:
+        await rec.call(self.client, "POST", "/api/checkout/session", "POST /api/checkout/session",
+                       json=checkout_body(random.choice(self.plan_ids)))
+
+    async def read_your_writes(self, rec: Recorder, state: dict) -> None:
+        plan_id = random.choice(self.plan_ids)
+        response = await rec.call(self.client, "POST", "/api/orders", "POST /api/orders", json={
+            "user_email": f"load_{uuid.uuid4().hex[:10]}@example.com", "subscription_plan_id": plan_id,
+        })
+        if response.status_code == 200:
+            # A 404 here is a stale read: the token did not hold the read back
+            await rec.call(self.client, "GET", f"/api/orders/{response.json()['id']}", "GET /api/orders/{order_id}",
+                           headers=read_token(response))
+
+    async def setup_polling(self, rec: Recorder) -> None:
+        self.sessions = await self._create_sessions(Recorder(), 50)
+        # Half settle, so both the Stripe path and the database path are exercised
+        for session_id in self.sessions[::2]:
+            FakeStripeCheckout.mark_paid(session_id)
+
+    async def status_polling(self, rec: Recorder, state: dict) -> None:
+        session_id = random.choice(self.sessions)
+        await rec.call(self.client, "GET", f"/api/checkout/status/{session_id}",
+                       "GET /api/checkout/status/{session_id}")
+
+    async def setup_webhooks(self, rec: Recorder) -> None:
+        self.sessions = await self._create_sessions(Recorder(), 200)
+
+    async def webhook_storm(self, rec: Recorder, state: dict) -> None:
+        session_id = random.choice(self.sessions)
+        # A small event-id space per session makes a realistic share of retries
+        event = {
+            "event_type": "checkout.session.completed",
+            "event_id": f"evt_{session_id}_{random.randint(0, 2)}",
+            "session_id": session_id,
+            "payment_status": "paid",
+        }
+        await rec.call(self.client, "POST", "/api/webhook/stripe", "POST /api/webhook/stripe",
+                       content=json.dumps(event), headers={"Stripe-Signature": "t=0,v1=fake"})
+
+    def registry(self) -> Dict[str, tuple]:
+        return {
+            "catalog": (None, self.catalog),
+            "auth": (None, self.auth),
+            "checkout": (None, self.checkout),
+            "read_your_writes": (None, self.read_your_writes),
+            "status_polling": (self.setup_polling, self.status_polling),
+            "webhook_storm": (self.setup_webhooks, self.webhook_storm),
+        }
+
+
+async def run_scenario(
+    setup: Optional[Callable[[Recorder], Awaitable[None]]],
+    iteration: Callable[[Recorder, dict], Awaitable[None]],
+    concurrency: int,
+    duration: float,
+) -> dict:
+    rec = Recorder()
+    if setup is not None:
+        await setup(rec)
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        state: dict = {}
+        while time.perf_counter() < deadline:
+            await iteration(rec, state)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return rec.summary(time.perf_counter() - start)
+
+
+# Awaitable mongomock-motor collection methods, each one round trip on a real server
+MOCK_ROUND_TRIP_METHODS = [
+    "bulk_write", "count_documents", "delete_many", "delete_one", "find_one", "find_one_and_update",
+    "insert_many", "insert_one", "update_many", "update_one",
+]
+
+
+def simulate_mongo_latency(seconds: float) -> None:
+    """Make mongomock-motor collection calls take a network round trip (cursors are not delayed)"""
+    from mongomock_motor import AsyncMongoMockCollection
+
+    for name in MOCK_ROUND_TRIP_METHODS:
+        original = getattr(AsyncMongoMockCollection, name)
+
+        async def delayed(self, *args, _original=original, **kwargs):
+            await asyncio.sleep(seconds)
+            return await _original(self, *args, **kwargs)
+
+        setattr(AsyncMongoMockCollection, name, delayed)
+
+
+def load_server(mongo: str, db_name: str, read_preference: str = "primary"):
+    """Import server.py wired to the chosen MongoDB and to FakeStripeCheckout"""
+    if mongo != "mock":
+        os.environ["MONGO_URL"] = mongo
+        os.environ["MONGO_READ_PREFERENCE"] = read_preference
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("STRIPE_API_KEY", "sk_test_loadtest")
+
+    import payments
+    payments.StripeCheckout = FakeStripeCheckout
+    import server
+    if mongo == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        server.app.state.mongo_client_factory = AsyncMongoMockClient
+    return server
+
+
+@asynccontextmanager
+async def running_app(server):
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest.local", timeout=60) as client:
+            yield client
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    FakeStripeCheckout.latency = args.stripe_latency_ms / 1000
+    if args.mongo == "mock" and args.mongo_latency_ms > 0:
+        simulate_mongo_latency(args.mongo_latency_ms / 1000)
+    db_name = f"loadtest_{uuid.uuid4().hex[:8]}"
+    server = load_server(args.mongo, db_name, args.read_preference)
+    results = {}
+    try:
+        async with running_app(server) as client:
+            scenarios = Scenarios(client, [plan["id"] for plan in server.catalog.plans()])
+            registry = scenarios.registry()
+            for name in args.scenarios:
+                setup, iteration = registry[name]
+                print(f"running {name} ...", file=sys.stderr)
+                results[name] = await run_scenario(setup, iteration, args.concurrency, args.duration)
+    finally:
+        if args.mongo != "mock" and not args.keep_db:
+            await server.client.drop_database(db_name)
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "started_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "mongo": "mongomock" if args.mongo == "mock" else "mongodb",
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "stripe_latency_ms": args.stripe_latency_ms,
+            "mongo_latency_ms": args.mongo_latency_ms if args.mongo == "mock" else None,
+            "read_preference": args.read_preference if args.mongo != "mock" else "primary",
+        },
+        "scenarios": results,
+    }
+
+
+def serialization_benchmark(orders: int, repeat: int) -> dict:
+    """Per-order cost of encoding an ``orders``-long response, before and after"""
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    server = load_server("mock", "serialization_bench")
+    from serialization import dumps
+
+    now = datetime.utcnow()
+    documents = [
+        server.Order(
+            user_email=f"bench_{i}@example.com", subscription_plan_id="capcut-pro-monthly",
+            amount=9.99, payment_session_id=f"cs_test_{i}", created_at=now, updated_at=now,
+        ).model_dump()
+        for i in range(orders)
+    ]
+    response_adapter = TypeAdapter(List[server.Order])
+
+    def before():
+        # What get_orders used to do: build models, then FastAPI re-validates them
+        # against response_model, converts to JSON-able dicts and json.dumps them
+        models = [server.Order(**document) for document in documents]
+        validated = response_adapter.validate_python(models, from_attributes=True)
+        return json.dumps(jsonable_encoder(response_adapter.dump_python(validated, mode="json"))).encode()
+
+    def after():
+        return dumps(documents)
+
+    assert json.loads(before()) == json.loads(after())
+    results = {}
+    for name, encode in (("before", before), ("after", after)):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encode()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results[name] = {"total_ms": round(best * 1000, 3), "per_order_us": round(best / orders * 1e6, 3)}
+    results["speedup"] = round(results["before"]["total_ms"] / results["after"]["total_ms"], 1)
+    return {"orders": orders, "repeat": repeat, "results": results}
+
+
+def compare(before: dict, after: dict) -> None:
+    """Print per-route p50/p99 and throughput changes between two reports"""
+    print(f"{'route':<48} {'p50 ms':>18} {'p99 ms':>18} {'rps':>16}")
+    for name, scenario in after["scenarios"].items():
+        print(f"[{name}]")
+        old_routes = before["scenarios"].get(name, {}).get("routes", {})
+        for route, new in scenario["routes"].items():
+            old = old_routes.get(route)
+            if old is None:
+                print(f"  {route:<46} {'(new)':>18}")
+                continue
+
+            def delta(key):
+                change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                return f"{old[key]:.1f}>{new[key]:.1f} {change:+.0f}%"
+
+            print(f"  {route:<46} {delta('p50_ms'):>18} {delta('p99_ms'):>18} {delta('throughput_rps'):>16}")
+
+
+def run_replica_set(members: int, first_port: int, name: str) -> None:
+    """Start ``members`` local mongod processes as one replica set and keep them up until interrupted"""
+    from pymongo import MongoClient
+
+    mongod = shutil.which("mongod")
+    if mongod is None:
+        sys.exit("mongod not found on PATH")
+    root = Path(tempfile.mkdtemp(prefix="loadtest-rs-"))
+    hosts = [f"127.0.0.1:{first_port + index}" for index in range(members)]
+    processes = []
+    try:
+        for host in hosts:
+            port = host.rsplit(":", 1)[1]
+            dbpath = root / port
+            dbpath.mkdir()
+            processes.append(subprocess.Popen(
+                [mongod, "--replSet", name, "--port", port, "--bind_ip", "127.0.0.1", "--dbpath", str(dbpath)],
+                stdout=subprocess.DEVNULL,
+            ))
+        admin = MongoClient(hosts[0], directConnection=True, serverSelectionTimeoutMS=30000)
+        admin.admin.command("replSetInitiate", {"_id": name, "members": [
+            # The first member is preferred as primary, so the others serve secondary reads
+            {"_id": index, "host": host, "priority": 2 if index == 0 else 1} for index, host in enumerate(hosts)
+        ]})
+        while not admin.admin.command("hello").get("isWritablePrimary"):
+            time.sleep(0.5)
+        print(f"mongodb://{','.join(hosts)}/?replicaSet={name}", flush=True)
+        print(f"replica set {name} is up ({members} members, data in {root}); Ctrl-C to stop", file=sys.stderr)
+        processes[0].wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run scenarios and print a JSON report")
+    run_parser.add_argument("--mongo", default="mock", help="'mock' for mongomock-motor, or a MongoDB URL")
+    run_parser.add_argument("--scenarios", nargs="+", default=[
+        "catalog", "auth", "checkout", "read_your_writes", "status_polling", "webhook_storm",
+    ])
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    run_parser.add_argument("--stripe-latency-ms", type=float, default=80.0)
+    run_parser.add_argument(
+        "--mongo-latency-ms", type=float, default=0.0, help="simulated round trip per mongomock call",
+    )
+    run_parser.add_argument(
+        "--read-preference", default="primary", help="MONGO_READ_PREFERENCE for a real MongoDB (mongomock has one node)",
+    )
+    run_parser.add_argument("--keep-db", action="store_true", help="keep the temporary database")
+    run_parser.add_argument("--output", help="write the report here instead of stdout")
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    bench_parser = commands.add_parser("serialization", help="benchmark order list serialization")
+    bench_parser.add_argument("--orders", type=int, default=1000)
+    bench_parser.add_argument("--repeat", type=int, default=20)
+    rs_parser = commands.add_parser("replica-set", help="run a local replica set and print its URL")
+    rs_parser.add_argument("--members", type=int, default=3)
+    rs_parser.add_argument("--port", type=int, default=27117, help="port of the first member; the rest follow")
+    rs_parser.add_argument("--name", default="loadtest")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(json.loads(Path(args.before).read_text()), json.loads(Path(args.after).read_text()))
+        return
+    if args.command == "replica-set":
+        run_replica_set(args.members, args.port, args.name)
+        return
+    if args.command == "serialization":
+        print(json.dumps(serialization_benchmark(args.orders, args.repeat), indent=2))
+        return
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Transactional email outbox delivered in the background over pooled SMTP connections.
+
+Request handlers only insert a message document; a background loop claims
+due messages in batches and hands them to a small thread pool, since
+``smtplib`` is blocking. Each thread reuses a persistent SMTP connection
+and failed deliveries are retried with exponential backoff.
+"""
+import asyncio
+import logging
+import os
+import queue
+import random
+import smtplib
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, NamedTuple, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Outbox document states
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class SMTPSettings(NamedTuple):
+    host: str
+    port: int = 587
+    username: Optional[str] = None
+    password: Optional[str] = None
+    sender: str = "no-reply@localhost"
+    starttls: bool = True
+    use_ssl: bool = False
+    timeout: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> Optional["SMTPSettings"]:
+        """Settings from SMTP_* variables, or None when SMTP_HOST is unset"""
+        host = os.environ.get('SMTP_HOST')
+        if not host:
+            return None
+        return cls(
+            host=host,
+            port=int(os.environ.get('SMTP_PORT', 587)),
+            username=os.environ.get('SMTP_USERNAME') or None,
+            password=os.environ.get('SMTP_PASSWORD') or None,
+            sender=os.environ.get('SMTP_SENDER', cls._field_defaults['sender']),
+            starttls=os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true',
+            use_ssl=os.environ.get('SMTP_SSL', 'false').lower() == 'true',
+            timeout=float(os.environ.get('SMTP_TIMEOUT', 10.0)),
+        )
+
+
+class SMTPConnectionPool:
+    """Thread-safe pool of open SMTP connections, reconnecting on demand"""
+
+    def __init__(self, settings: SMTPSettings, size: int):
+        self.settings = settings
+        self._idle: "queue.LifoQueue[smtplib.SMTP]" = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> smtplib.SMTP:
+        s = self.settings
+        if s.use_ssl:
+            conn = smtplib.SMTP_SSL(s.host, s.port, timeout=s.timeout)
+        else:
+            conn = smtplib.SMTP(s.host, s.port, timeout=s.timeout)
+            if s.starttls:
+                conn.starttls()
+        if s.username:
+            conn.login(s.username, s.password or "")
+        return conn
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except OSError:  # includes SMTPException
+                pass
+            self._discard(conn)
+
+    def release(self, conn: smtplib.SMTP) -> None:
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    @staticmethod
+    def _discard(conn: smtplib.SMTP) -> None:
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def build_mime(message: dict, sender: str) -> MIMEMultipart:
+    mime = MIMEMultipart("alternative")
+    mime["From"] = sender
+    mime["To"] = message["to"]
+    mime["Subject"] = message["subject"]
+    mime.attach(MIMEText(message["text"], "plain"))
+    if message.get("html"):
+        mime.attach(MIMEText(message["html"], "html"))
+    return mime
+
+
+class EmailOutbox:
+    """Mongo-backed outbox with a background, thread-pooled SMTP sender"""
+
+    def __init__(
+        self,
+        db,
+        settings: Optional[SMTPSettings],
+        workers: int = 2,
+        batch_size: int = 50,
+        poll_interval: float = 2.0,
+        max_attempts: int = 6,
+        base_backoff: float = 30.0,
+        claim_timeout: float = 300.0,
+    ):
+        self.db = db
+        self.settings = settings
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.claim_timeout = claim_timeout
+        self._pool: Optional[SMTPConnectionPool] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings is not None
+
+    async def enqueue_many(self, messages: List[dict]) -> None:
+        """Queue messages with ``to``, ``subject``, ``text`` and optional ``html``/``kind``"""
+        if not self.enabled or not messages:
+            return
+        now = datetime.utcnow()
+        await self.db.email_outbox.insert_many([
+            {**message, "status": PENDING, "attempts": 0, "next_attempt_at": now, "created_at": now}
+            for message in messages
+        ])
+        self._wakeup.set()
+
+    async def enqueue(self, to: str, subject: str, text: str, html: Optional[str] = None, kind: Optional[str] = None) -> None:
+        await self.enqueue_many([{"to": to, "subject": subject, "text": text, "html": html, "kind": kind}])
+
+    async def _claim_batch(self) -> List[dict]:
+        now = datetime.utcnow()
+        # Messages stuck in "sending" belong to a sender that died mid-batch
+        due = {"$or": [
+            {"status": PENDING, "next_attempt_at": {"$lte": now}},
+            {"status": SENDING, "claimed_at": {"$lt": now - timedelta(seconds=self.claim_timeout)}},
+        ]}
+        candidates = await self.db.email_outbox.find(due, {"_id": 1}) \
+            .sort("next_attempt_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        claim = uuid.uuid4().hex
+        ids = [doc["_id"] for doc in candidates]
+        await self.db.email_outbox.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": SENDING, "claim": claim, "claimed_at": now}},
+        )
+        return await self.db.email_outbox.find({"_id": {"$in": ids}, "claim": claim}).to_list(self.batch_size)
+
+    def _send_chunk(self, messages: List[dict]) -> List[Optional[str]]:
+        """Deliver messages over one pooled connection; returns an error per message or None"""
+        results: List[Optional[str]] = []
+        conn = None
+        for message in messages:
+            try:
+                if conn is None:
+                    conn = self._pool.acquire()
+                conn.send_message(build_mime(message, self.settings.sender))
+                results.append(None)
+            except (smtplib.SMTPException, OSError) as e:
+                results.append(str(e) or type(e).__name__)
+                # A rejected message leaves the session usable; only a dead connection is dropped
+                if conn is not None and (
+                    isinstance(e, smtplib.SMTPServerDisconnected) or not isinstance(e, smtplib.SMTPException)
+                ):
+                    conn.close()
+                    conn = None
+        if conn is not None:
+            self._pool.release(conn)
+        return results
+
+    def _retry_at(self, attempts: int, now: datetime) -> datetime:
+        delay = self.base_backoff * 2 ** (attempts - 1)
+        return now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+    async def drain_once(self) -> int:
+        """Send one batch; returns the number of messages attempted"""
+        messages = await self._claim_batch()
+        if not messages:
+            return 0
+        loop = asyncio.get_running_loop()
+        chunks = [messages[i::self.workers] for i in range(self.workers) if messages[i::self.workers]]
+        chunk_results = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, self._send_chunk, chunk) for chunk in chunks
+        ])
+
+        now = datetime.utcnow()
+        updates = []
+        for chunk, results in zip(chunks, chunk_results):
+            for message, error in zip(chunk, results):
+                if error is None:
+                    update = {"$set": {"status": SENT, "sent_at": now}, "$unset": {"claim": ""}}
+                else:
+                    attempts = message["attempts"] + 1
+                    status = FAILED if attempts >= self.max_attempts else PENDING
+                    update = {
+                        "$set": {
+                            "status": status, "attempts": attempts, "last_error": error,
+                            "next_attempt_at": self._retry_at(attempts, now),
+                        },
+                        "$unset": {"claim": ""},
+                    }
+                    logger.warning("Email to %s failed (attempt %d): %s", message["to"], attempts, error)
+                updates.append(UpdateOne({"_id": message["_id"]}, update))
+        await self.db.email_outbox.bulk_write(updates, ordered=False)
+        return len(messages)
+
+    async def run(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                if await self.drain_once() == self.batch_size:
+                    continue
+            except Exception as e:
+                logger.error("Email outbox sender error: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if not self.enabled:
+            logger.info("SMTP_HOST not set; transactional email is disabled")
+            return
+        self._pool = SMTPConnectionPool(self.settings, size=self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smtp")
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+def welcome_message(user: dict) -> dict:
+    return {
+        "kind": "welcome",
+        "to": user["email"],
+        "subject": "Welcome to Premium Subscription Store",
+        "text": f"Hi {user['first_name']},\n\nYour account has been created. Welcome aboard!\n",
+    }
+
+
+def order_confirmation_message(order: dict, plan: Optional[dict]) -> dict:
+    name = f"{plan['service_name']} {plan['plan_name']}" if plan else order["subscription_plan_id"]
+    return {
+        "kind": "order_confirmation",
+        "to": order["user_email"],
+        "subject": f"Your order for {name} is confirmed",
+        "text": (
+            f"Thanks for your purchase!\n\n"
+            f"Order: {order['id']}\n"
+            f"Plan: {name}\n"
+            f"Amount: {order['amount']:.2f} {order['currency'].upper()}\n"
+        ),
+    }
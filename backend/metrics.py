@@ -0,0 +1,202 @@
+"""Request, MongoDB and Stripe latency metrics in Prometheus text format.
+
+``MetricsMiddleware`` times every request per route template and status.
+``MongoCommandTimer`` is a pymongo CommandListener, and ``track_stripe``
+wraps outbound Stripe calls. Both also add to a per-request breakdown, so
+a sample of slow requests can be logged with where their time went.
+"""
+import bisect
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request timing breakdown; Motor copies the context into its executor
+# threads, so the listener mutates the same dict as the request handler.
+_breakdown: ContextVar[Optional[dict]] = ContextVar("request_breakdown", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauge (or counter) whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[Sequence[str], float]]], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error("Failed to collect metric %s: %s", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template and status",
+    ["method", "route", "status"],
+))
+MONGO_COMMAND_DURATION = REGISTRY.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by command name and outcome",
+    ["command", "outcome"],
+))
+STRIPE_CALL_DURATION = REGISTRY.register(Histogram(
+    "stripe_call_duration_seconds", "Outbound Stripe call latency by operation and outcome",
+    ["operation", "outcome"], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+))
+
+
+def _add_to_breakdown(kind: str, seconds: float) -> None:
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown[f"{kind}_ms"] += seconds * 1000
+        breakdown[f"{kind}_calls"] += 1
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Records every MongoDB command's server round-trip time"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.observe(seconds, event.command_name, "ok")
+        _add_to_breakdown("mongo", seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.observe(seconds, event.command_name, "error")
+        _add_to_breakdown("mongo", seconds)
+
+
+@asynccontextmanager
+async def track_stripe(operation: str):
+    """Time an outbound Stripe call"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - start
+        STRIPE_CALL_DURATION.observe(seconds, operation, outcome)
+        _add_to_breakdown("stripe", seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing requests per route template, with a sampled slow-request log"""
+
+    def __init__(self, app, slow_threshold_ms: float = 1000.0, slow_sample_rate: float = 0.0):
+        self.app = app
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_sample_rate = slow_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        breakdown = {"mongo_ms": 0.0, "mongo_calls": 0, "stripe_ms": 0.0, "stripe_calls": 0}
+        token = _breakdown.set(breakdown)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - start
+            _breakdown.reset(token)
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(seconds, scope["method"], template, str(status["code"]))
+            if seconds * 1000 >= self.slow_threshold_ms and random.random() < self.slow_sample_rate:
+                logger.warning(
+                    "Slow request %s %s status=%s total_ms=%.1f mongo_ms=%.1f mongo_calls=%d stripe_ms=%.1f stripe_calls=%d",
+                    scope["method"], template, status["code"], seconds * 1000,
+                    breakdown["mongo_ms"], breakdown["mongo_calls"], breakdown["stripe_ms"], breakdown["stripe_calls"],
+                )
@@ -0,0 +1,178 @@
+"""Rewrite orders and payment transactions in place into the compact (v2) schema.
+
+    python migrate.py compact                  # all collections, resumable
+    python migrate.py compact --max-rate 500   # at most 500 documents/s
+    python migrate.py report                   # sizes only
+
+Documents are visited in ``_id`` order in batches, and the last ``_id`` of
+every batch is checkpointed in the ``migrations`` collection, so an
+interrupted run picks up where it stopped (``--restart`` starts over).
+Each document is upgraded with ``$set``/``$unset`` of its insert-only
+fields and of its ``None`` fields, guarded on ``_v`` being absent and on
+those fields still being ``None``; a document that lost the race stays v1
+until a ``--restart`` run. The API keeps serving and writing
+the fields it updates while the migration runs, and the app reads both
+versions.
+
+The report compares collStats before and after. WiredTiger keeps the freed
+pages for reuse, so ``storageSize`` only shrinks after ``--compact`` (which
+runs the ``compact`` command; schedule it off-peak).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import bson
+from pydantic import ValidationError
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+from schema import (
+    ORDER_V1_ONLY, SCHEMA_VERSION, TRANSACTION_V1_ONLY, VERSION_FIELD, order_document, order_from_document,
+    transaction_document, transaction_from_document,
+)
+
+CHECKPOINTS = "migrations"
+MIGRATION = f"compact-v{SCHEMA_VERSION}"
+
+
+class Target(NamedTuple):
+    collection: str
+    encode: Callable[[dict], dict]
+    v1_only: List[str]
+
+
+TARGETS = [
+    Target("orders", lambda doc: order_document(order_from_document(doc)), ORDER_V1_ONLY),
+    Target("orders_archive", lambda doc: order_document(order_from_document(doc)), ORDER_V1_ONLY),
+    Target("payment_transactions", lambda doc: transaction_document(transaction_from_document(doc)), TRANSACTION_V1_ONLY),
+]
+
+
+def upgrade(doc: dict, target: Target) -> UpdateOne:
+    """In-place upgrade touching only insert-only fields and fields that are still ``None``"""
+    compact = target.encode(doc)
+    renamed = {key: value for key, value in compact.items() if key not in doc or doc[key] != value}
+    # v2 leaves None fields out; guard on them still being None, since some
+    # (a transaction's session_id) are filled in later by the API
+    cleared = [key for key, value in doc.items() if value is None and key not in compact]
+    unset = {name: "" for name in target.v1_only if name in doc and name not in compact}
+    unset.update({name: "" for name in cleared})
+    update = {"$set": renamed}
+    if unset:
+        update["$unset"] = unset
+    guard = {"_id": doc["_id"], VERSION_FIELD: {"$exists": False}, **{name: None for name in cleared}}
+    return UpdateOne(guard, update)
+
+
+async def collection_stats(db, name: str) -> Dict[str, Optional[int]]:
+    try:
+        stats = await db.command("collStats", name)
+        return {key: stats.get(key) for key in ("count", "size", "storageSize", "totalIndexSize")}
+    except (OperationFailure, TypeError, NotImplementedError):
+        # No collStats (mongomock): measure the documents, indexes unknown
+        count = size = 0
+        async for doc in db[name].find({}):
+            count += 1
+            size += len(bson.encode(doc))
+        return {"count": count, "size": size, "storageSize": None, "totalIndexSize": None}
+
+
+async def migrate_collection(db, target: Target, batch_size: int, max_rate: float, restart: bool, dry_run: bool) -> dict:
+    checkpoints = db[CHECKPOINTS]
+    checkpoint_id = f"{MIGRATION}:{target.collection}"
+    checkpoint = None if restart else await checkpoints.find_one({"_id": checkpoint_id})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    migrated = checkpoint.get("migrated", 0) if checkpoint else 0
+    scanned = skipped = 0
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        started = time.monotonic()
+        batch = await db[target.collection].find(query).sort([("_id", ASCENDING)]) \
+            .limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        operations = []
+        for doc in batch:
+            if doc.get(VERSION_FIELD) == SCHEMA_VERSION:
+                continue
+            try:
+                operations.append(upgrade(doc, target))
+            except (KeyError, ValidationError) as e:
+                # Left as v1 (still readable); fix by hand and rerun with --restart
+                skipped += 1
+                print(f"{target.collection}: skipping {doc['_id']}: {e!r}", file=sys.stderr)
+        if operations and not dry_run:
+            result = await db[target.collection].bulk_write(operations, ordered=False)
+            migrated += result.modified_count
+        elif dry_run:
+            migrated += len(operations)
+        scanned += len(batch)
+        last_id = batch[-1]["_id"]
+        if not dry_run:
+            await checkpoints.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {"last_id": last_id, "migrated": migrated, "updated_at": datetime.utcnow()}},
+                upsert=True,
+            )
+        print(f"{target.collection}: scanned {scanned}, upgraded {migrated}, skipped {skipped}", file=sys.stderr)
+        if max_rate > 0:
+            # Throttle: never faster than max_rate documents per second
+            await asyncio.sleep(max(0.0, len(batch) / max_rate - (time.monotonic() - started)))
+    if not dry_run:
+        await checkpoints.update_one(
+            {"_id": checkpoint_id}, {"$set": {"completed_at": datetime.utcnow()}}, upsert=True
+        )
+    return {"scanned": scanned, "upgraded": migrated, "skipped": skipped}
+
+
+def print_report(before: Dict[str, dict], after: Dict[str, dict]) -> None:
+    print(f"{'collection':<22}{'metric':<16}{'before':>14}{'after':>14}{'change':>9}")
+    for name in before:
+        for metric in ("count", "size", "storageSize", "totalIndexSize"):
+            old, new = before[name][metric], after[name][metric]
+            if old is None or new is None:
+                change, old, new = "", old if old is not None else "n/a", new if new is not None else "n/a"
+            else:
+                change = f"{(new - old) / old * 100:+.0f}%" if old else ""
+            print(f"{name:<22}{metric:<16}{old:>14}{new:>14}{change:>9}")
+
+
+async def _main(args) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    targets = [target for target in TARGETS if target.collection in args.collections]
+    try:
+        before = {target.collection: await collection_stats(db, target.collection) for target in targets}
+        if args.command == "compact":
+            for target in targets:
+                await migrate_collection(db, target, args.batch_size, args.max_rate, args.restart, args.dry_run)
+                if args.compact and not args.dry_run:
+                    await db.command("compact", target.collection)
+        after = {target.collection: await collection_stats(db, target.collection) for target in targets}
+        print_report(before, after)
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["compact", "report"])
+    parser.add_argument("--collections", nargs="+", default=[target.collection for target in TARGETS])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-rate", type=float, default=2000.0, help="documents per second; 0 for no limit")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and rescan from the start")
+    parser.add_argument("--dry-run", action="store_true", help="count what would change without writing")
+    parser.add_argument("--compact", action="store_true", help="run the compact command afterwards to release space")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_main(args)))
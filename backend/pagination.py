@@ -0,0 +1,43 @@
+"""Keyset pagination on (created_at, id) with opaque cursors."""
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from pymongo import DESCENDING
+
+# Newest first; id breaks ties between documents created in the same instant
+KEYSET_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(doc: dict) -> str:
+    """Opaque cursor pointing just past ``doc`` in keyset order"""
+    raw = json.dumps({"c": doc["created_at"].isoformat(), "i": doc["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return {"created_at": datetime.fromisoformat(raw["c"]), "id": str(raw["i"])}
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def keyset_query(query: dict, after: Optional[str]) -> dict:
+    """Restrict ``query`` to documents that sort after the given cursor"""
+    if not after:
+        return query
+    position = decode_cursor(after)
+    return {
+        **query,
+        "$or": [
+            {"created_at": {"$lt": position["created_at"]}},
+            {"created_at": position["created_at"], "id": {"$lt": position["id"]}},
+        ],
+    }
@@ -0,0 +1,141 @@
+"""Process-wide Stripe client sharing one keep-alive HTTP connection pool.
+
+Every Stripe API call goes through a ``ResiliencePolicy``: a per-call
+deadline, a bulkhead sized to the connection pool and a circuit breaker,
+with jittered retries for status reads (the only idempotent call). Webhook
+verification is local and runs outside it: a Stripe outage must not reject
+webhooks, and forged ones must not count against Stripe's health.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Optional
+
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+
+from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionRequest
+from metrics import track_stripe
+from resilience import Bulkhead, CircuitBreaker, ResiliencePolicy
+
+# Webhook URLs derived from the request's Host header are client-controlled; bound what they can pin
+MAX_CHECKOUT_CLIENTS = 8
+
+
+def _client_errors() -> tuple:
+    # Invalid requests say nothing about Stripe's health
+    errors = stripe if hasattr(stripe, "InvalidRequestError") else stripe.error
+    return (errors.InvalidRequestError,)
+
+
+def _requests_client_class():
+    # stripe>=8 exports the client at top level; older releases only in http_client
+    return getattr(stripe, "RequestsClient", None) or stripe.http_client.RequestsClient
+
+
+class PaymentClient:
+    """Long-lived StripeCheckout wrapper, created once per worker at startup"""
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        pool_size: int = 20,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_network_retries: int = 1,
+        create_timeout: float = 10.0,
+        status_timeout: float = 5.0,
+        status_retries: int = 2,
+        bulkhead_wait: float = 0.25,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        webhook_url: Optional[str] = None,
+    ):
+        self.api_key = api_key
+        self.webhook_url = webhook_url
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_network_retries = max_network_retries
+        self.create_timeout = create_timeout
+        self.status_timeout = status_timeout
+        self.status_retries = status_retries
+        self.policy = ResiliencePolicy(
+            "stripe",
+            CircuitBreaker(failure_threshold=breaker_failures, reset_timeout=breaker_reset),
+            Bulkhead(max_concurrent=pool_size, max_wait=bulkhead_wait),
+            client_errors=_client_errors(),
+        )
+        self._session: Optional[requests.Session] = None
+        self._checkouts: "OrderedDict[str, StripeCheckout]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "PaymentClient":
+        return cls(
+            api_key=os.environ.get('STRIPE_API_KEY'),
+            pool_size=int(os.environ.get('STRIPE_HTTP_POOL_SIZE', 20)),
+            connect_timeout=float(os.environ.get('STRIPE_CONNECT_TIMEOUT', 5.0)),
+            read_timeout=float(os.environ.get('STRIPE_READ_TIMEOUT', 30.0)),
+            max_network_retries=int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES', 1)),
+            create_timeout=float(os.environ.get('STRIPE_CREATE_TIMEOUT', 10.0)),
+            status_timeout=float(os.environ.get('STRIPE_STATUS_TIMEOUT', 5.0)),
+            status_retries=int(os.environ.get('STRIPE_STATUS_RETRIES', 2)),
+            bulkhead_wait=float(os.environ.get('STRIPE_BULKHEAD_WAIT', 0.25)),
+            breaker_failures=int(os.environ.get('STRIPE_BREAKER_FAILURES', 5)),
+            breaker_reset=float(os.environ.get('STRIPE_BREAKER_RESET', 30.0)),
+            webhook_url=os.environ.get('STRIPE_WEBHOOK_URL') or None,
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def start(self) -> None:
+        """Install the pooled HTTP session as the Stripe SDK's transport"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._session = session
+        stripe.default_http_client = _requests_client_class()(
+            timeout=(self.connect_timeout, self.read_timeout), session=session
+        )
+        stripe.max_network_retries = self.max_network_retries
+
+    def close(self) -> None:
+        self._checkouts.clear()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def checkout(self, webhook_url: str = "") -> StripeCheckout:
+        """Reuse one StripeCheckout per webhook URL instead of one per request"""
+        checkout = self._checkouts.get(webhook_url)
+        if checkout is None:
+            checkout = StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+            self._checkouts[webhook_url] = checkout
+            while len(self._checkouts) > MAX_CHECKOUT_CLIENTS:
+                self._checkouts.popitem(last=False)
+        else:
+            self._checkouts.move_to_end(webhook_url)
+        return checkout
+
+    async def create_checkout_session(self, checkout_request: CheckoutSessionRequest, webhook_url: str):
+        async def create():
+            async with track_stripe("create_checkout_session"):
+                return await self.checkout(webhook_url).create_checkout_session(checkout_request)
+
+        # Not retried: a retry after a timeout could open a second session
+        return await self.policy.call(create, timeout=self.create_timeout)
+
+    async def get_checkout_status(self, session_id: str):
+        async def fetch():
+            async with track_stripe("get_checkout_status"):
+                return await self.checkout().get_checkout_status(session_id)
+
+        return await self.policy.call(fetch, timeout=self.status_timeout, retries=self.status_retries)
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        async with track_stripe("handle_webhook"):
+            return await asyncio.wait_for(self.checkout().handle_webhook(body, signature), timeout=self.status_timeout)
@@ -0,0 +1,106 @@
+"""Read-preference routing for read-heavy endpoints, with read-your-writes tokens.
+
+Order listings, order lookups and login can be served by secondaries
+(``MONGO_READ_PREFERENCE``, e.g. ``secondaryPreferred``). A secondary may lag
+the primary, so those reads run in causally consistent sessions: responses
+carry an ``X-Read-Token`` holding the session's cluster and operation time,
+and a request that sends it back only reads from a member that has caught
+up to that point. A user who just signed up or paid sees their own writes
+wherever the read lands.
+
+Tokens are HMAC-signed: an afterClusterTime far in the future would make a
+secondary hold the read until it timed out. With the default ``primary``
+preference none of this is needed, so no sessions are started and no
+tokens are issued.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import bson
+from bson.errors import BSONError
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+logger = logging.getLogger(__name__)
+
+READ_TOKEN_HEADER = "X-Read-Token"
+PRIMARY = "primary"
+
+
+class ReadRouting:
+    """The database handle for routable reads, and causally consistent sessions for them"""
+
+    def __init__(self, client, db_name: str, read_preference: str = PRIMARY, max_staleness: int = -1, secret: bytes = b""):
+        self.client = client
+        self.primary = client[db_name]
+        self.enabled = read_preference != PRIMARY
+        if self.enabled:
+            mode = make_read_preference(read_pref_mode_from_name(read_preference), None, max_staleness)
+            self.db = client.get_database(db_name, read_preference=mode)
+        else:
+            self.db = self.primary
+        self._secret = secret or secrets.token_bytes(32)
+
+    @classmethod
+    def from_env(cls, client, db_name: str) -> "ReadRouting":
+        read_preference = os.environ.get('MONGO_READ_PREFERENCE', PRIMARY)
+        secret = os.environ.get('READ_TOKEN_SECRET', '')
+        if read_preference != PRIMARY and not secret:
+            # Tokens from one process are ignored by another; set READ_TOKEN_SECRET for multi-worker deployments
+            logger.warning("READ_TOKEN_SECRET not set; using a random per-process signing key")
+        return cls(
+            client,
+            db_name,
+            read_preference=read_preference,
+            max_staleness=int(os.environ.get('MONGO_READ_MAX_STALENESS_S', -1)),
+            secret=secret.encode(),
+        )
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()[:16]
+
+    def token(self, session) -> Optional[str]:
+        """Token for everything ``session`` has seen or written so far"""
+        if session is None or session.operation_time is None:
+            return None
+        payload = bson.encode({"c": session.cluster_time, "o": session.operation_time})
+        return base64.urlsafe_b64encode(self._sign(payload) + payload).decode().rstrip("=")
+
+    def _advance(self, session, token: str) -> None:
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            signature, payload = raw[:16], raw[16:]
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                raise ValueError("bad signature")
+            times = bson.decode(payload)
+        except (ValueError, BSONError) as e:
+            # A stale or foreign token only costs read-your-writes, never the request
+            logger.debug("Ignoring read token: %s", e)
+            return
+        if times.get("c"):
+            session.advance_cluster_time(times["c"])
+        session.advance_operation_time(times["o"])
+
+    @asynccontextmanager
+    async def session(self, token: Optional[str] = None) -> AsyncIterator[Optional[object]]:
+        """A causally consistent session that reads no older than ``token``; None when routing is off"""
+        if not self.enabled:
+            yield None
+            return
+        async with await self.client.start_session(causal_consistency=True) as session:
+            if token:
+                self._advance(session, token)
+            yield session
+
+    async def primary_token(self) -> Optional[str]:
+        """Token for everything the primary has applied so far, for writes made outside the request"""
+        if not self.enabled:
+            return None
+        async with self.session() as session:
+            await self.primary.command("ping", session=session)
+            return self.token(session)
@@ -0,0 +1,172 @@
+"""Background reconciliation of checkout sessions nobody is polling any more.
+
+Transactions still open some minutes after checkout are looked up on Stripe
+with bounded concurrency. Every status change from one pass is written in a
+single ``bulk_write``, and the orders for newly paid sessions are then
+created in one more, so a payment completes even if the buyer closed the tab
+and the webhook never arrived.
+
+Each pass also checks a batch of recently paid transactions for their order
+and creates any that are missing, e.g. when the order write failed after the
+payment was recorded. Batches walk the ``max_age`` window and wrap around.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from pymongo import ASCENDING, UpdateOne
+
+from indexes import HAS_STRING_ID
+
+logger = logging.getLogger(__name__)
+
+OPEN_PAYMENT_STATUSES = ["pending", "unpaid"]
+
+
+class PaymentReconciler:
+    """Periodically settles stale pending payment transactions from Stripe"""
+
+    def __init__(
+        self,
+        db,
+        payments: Callable[[], object],
+        fulfillment,
+        stale_after: float = 600.0,
+        recheck_after: float = 600.0,
+        max_age: float = 48 * 3600.0,
+        batch_size: int = 200,
+        concurrency: int = 8,
+        interval: float = 60.0,
+        on_status_changed: Optional[Callable[[str], None]] = None,
+    ):
+        self.db = db
+        self.payments = payments
+        self.fulfillment = fulfillment
+        self.stale_after = stale_after
+        self.recheck_after = recheck_after
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.interval = interval
+        self.on_status_changed = on_status_changed
+        self._paid_after: Optional[datetime] = None  # where the next paid-without-order check resumes
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def stale_query(self, now: datetime) -> dict:
+        """Open transactions created before the staleness cutoff and not checked recently.
+
+        The payment_status/created_at prefix is served by the
+        payment_transactions_reconcile index; the rest is a residual filter.
+        """
+        return {
+            "payment_status": {"$in": OPEN_PAYMENT_STATUSES},
+            "created_at": {
+                "$lt": now - timedelta(seconds=self.stale_after),
+                "$gt": now - timedelta(seconds=self.max_age),
+            },
+            "session_id": {"$type": "string"},
+            "status": {"$ne": "expired"},
+            "$or": [
+                {"reconciled_at": {"$exists": False}},
+                {"reconciled_at": {"$lt": now - timedelta(seconds=self.recheck_after)}},
+            ],
+        }
+
+    async def _fetch_status(self, session_id: str):
+        async with self._semaphore:
+            try:
+                return await self.payments().get_checkout_status(session_id)
+            except Exception as e:
+                logger.warning("Reconciler could not fetch checkout session %s: %s", session_id, e)
+                return None
+
+    async def reconcile_once(self) -> int:
+        """One pass over a batch of stale transactions; returns how many changed"""
+        now = datetime.utcnow()
+        stale = await self.db.payment_transactions.find(self.stale_query(now)).sort(
+            [("created_at", ASCENDING)]
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not stale:
+            return 0
+
+        statuses = await asyncio.gather(*[self._fetch_status(tx["session_id"]) for tx in stale])
+        operations = []
+        changed: List[str] = []
+        paid: List[dict] = []
+        for tx, checkout_status in zip(stale, statuses):
+            if checkout_status is None:
+                continue
+            update = {"$set": {"reconciled_at": now}}
+            query = {"_id": tx["_id"]}
+            if tx["status"] != checkout_status.status or tx["payment_status"] != checkout_status.payment_status:
+                update = self.fulfillment.status_update(checkout_status.payment_status, checkout_status.status, now)
+                update["$set"]["reconciled_at"] = now
+                query.update(self.fulfillment.status_filter(checkout_status.payment_status))
+                changed.append(tx["session_id"])
+                if checkout_status.payment_status == "paid":
+                    paid.append({**tx, **update["$set"]})
+            operations.append(UpdateOne(query, update))
+
+        if operations:
+            await self.db.payment_transactions.bulk_write(operations, ordered=False)
+        if paid:
+            await self.fulfillment.materialize_orders(paid)
+        if self.on_status_changed is not None:
+            for session_id in changed:
+                self.on_status_changed(session_id)
+        if changed:
+            logger.info("Reconciled %d of %d stale checkout sessions (%d paid)", len(changed), len(stale), len(paid))
+        return len(changed)
+
+    async def fulfill_paid_once(self) -> int:
+        """Create the orders missing for one batch of recently paid transactions; returns how many"""
+        now = datetime.utcnow()
+        window_start = now - timedelta(seconds=self.max_age)
+        paid = await self.db.payment_transactions.find({
+            "payment_status": "paid",
+            "created_at": {"$gt": max(window_start, self._paid_after or window_start)},
+            "session_id": {"$type": "string"},
+        }).sort([("created_at", ASCENDING)]).limit(self.batch_size).to_list(self.batch_size)
+        self._paid_after = paid[-1]["created_at"] if len(paid) == self.batch_size else None
+        if not paid:
+            return 0
+
+        session_ids = [tx["session_id"] for tx in paid]
+        fulfilled = {
+            order["payment_session_id"]
+            async for order in self.db.orders.find(
+                {"payment_session_id": {"$in": session_ids, **HAS_STRING_ID}}, {"_id": 0, "payment_session_id": 1}
+            )
+        }
+        missing = [tx for tx in paid if tx["session_id"] not in fulfilled]
+        if not missing:
+            return 0
+        created = await self.fulfillment.materialize_orders(missing)
+        if created:
+            logger.warning("Created %d missing orders for paid checkout sessions", len(created))
+        return len(created)
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.reconcile_once()
+                await self.fulfill_paid_once()
+            except Exception as e:
+                logger.error("Payment reconciler error: %s", e)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Let the current pass finish, then stop"""
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
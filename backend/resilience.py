@@ -0,0 +1,188 @@
+"""Deadlines, bulkhead, circuit breaker and retries for calls to a remote dependency.
+
+``ResiliencePolicy.call`` runs one operation:
+
+* the circuit breaker rejects it straight away while the dependency is known
+  to be failing, and lets one trial call through after ``reset_timeout``;
+* the bulkhead caps concurrent calls and rejects rather than queueing for
+  longer than ``max_wait``;
+* every attempt gets its own deadline;
+* idempotent operations retry transient failures with full-jitter backoff.
+
+Rejections and exhausted deadlines raise ``DependencyUnavailable`` carrying a
+``retry_after`` hint, which the API turns into a 503 with ``Retry-After``.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class DependencyUnavailable(Exception):
+    """A call was rejected or timed out; the caller should fail fast"""
+
+    def __init__(self, dependency: str, reason: str, retry_after: float):
+        super().__init__(f"{dependency} unavailable ({reason})")
+        self.dependency = dependency
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures; half-opens after ``reset_timeout``"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.retry_after() > 0:
+                return False
+            # Reset timeout elapsed: let a single trial call through
+            if self._trial_in_flight:
+                return False
+            self.state = HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def release_trial(self) -> None:
+        """The trial call ended without an outcome (rejected by the bulkhead, or cancelled): allow another"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class Bulkhead:
+    """Caps concurrent calls; waits at most ``max_wait`` seconds for a slot"""
+
+    def __init__(self, max_concurrent: int = 20, max_wait: float = 0.25):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def acquire(self) -> bool:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class ResiliencePolicy:
+    """Guards every call to one dependency with a shared breaker and bulkhead"""
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        bulkhead: Bulkhead,
+        client_errors: Tuple[Type[BaseException], ...] = (),
+        retry_base_delay: float = 0.1,
+        retry_max_delay: float = 1.0,
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+        # Errors caused by the request itself: re-raised as-is, never retried
+        # and never counted against the dependency's health
+        self.client_errors = client_errors
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.rejections: Dict[str, int] = defaultdict(int)
+
+    def _reject(self, reason: str, retry_after: float) -> DependencyUnavailable:
+        self.rejections[reason] += 1
+        return DependencyUnavailable(self.name, reason, retry_after)
+
+    async def _attempt(self, operation: Callable[[], Awaitable[T]], timeout: float) -> T:
+        if not self.breaker.allow():
+            raise self._reject("circuit_open", self.breaker.retry_after())
+        trial = self.breaker.state == HALF_OPEN
+        try:
+            if not await self.bulkhead.acquire():
+                raise self._reject("bulkhead_full", 1.0)
+            try:
+                result = await asyncio.wait_for(operation(), timeout=timeout)
+            except self.client_errors:
+                self.breaker.record_success()
+                raise
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                raise self._reject("timeout", 1.0)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            finally:
+                self.bulkhead.release()
+            self.breaker.record_success()
+            return result
+        finally:
+            if trial:
+                # No-op once the trial recorded an outcome
+                self.breaker.release_trial()
+
+    async def call(self, operation: Callable[[], Awaitable[T]], timeout: float, retries: int = 0) -> T:
+        """Run ``operation`` under the policy; retry only idempotent operations (``retries`` > 0)"""
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(operation, timeout)
+            except self.client_errors:
+                raise
+            except DependencyUnavailable as e:
+                if e.reason == "circuit_open" or attempt >= retries:
+                    raise
+            except Exception:
+                if attempt >= retries:
+                    raise
+            attempt += 1
+            # Full jitter keeps retries from many requests from arriving together
+            await asyncio.sleep(random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)))
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.bulkhead.in_flight,
+            "rejections": dict(self.rejections),
+        }
@@ -0,0 +1,151 @@
+"""Compact, versioned storage schema for orders and payment transactions.
+
+Version 2 documents carry ``_v: 2`` and differ from the API models in
+three ways:
+
+* amounts are integers in minor units (cents, as Stripe reports them)
+  instead of floats;
+* fields that are only ever written on insert are stored under short
+  names, declared as the Pydantic aliases of ``StoredOrder`` and
+  ``StoredTransaction``. Fields that queries, indexes or later updates
+  touch keep their names, so the same query works on a collection that is
+  halfway through ``migrate.py`` with both versions side by side;
+* nothing redundant is stored. ``None`` fields are left out, an order's
+  ``updated_at`` is dropped (orders are never updated), and a transaction's
+  ``metadata`` keeps only keys not already on the document or in the
+  catalog.
+
+``*_document`` builds what is stored. ``*_from_document`` turns a document
+of either version back into the API shape with plain dict operations, so
+order reads stay on the orjson fast path.
+"""
+from datetime import datetime
+from typing import Dict, Optional, Type
+
+from pydantic import BaseModel, ConfigDict, Field
+
+SCHEMA_VERSION = 2
+VERSION_FIELD = "_v"
+MINOR_UNITS = 100
+
+# Stripe metadata keys that the transaction (or the catalog, by plan id) already holds
+REDUNDANT_METADATA = ("subscription_plan_id", "user_email", "plan_name", "service_name")
+
+
+def to_minor(amount: float) -> int:
+    return int(round(amount * MINOR_UNITS))
+
+
+def from_minor(amount: int) -> float:
+    return amount / MINOR_UNITS
+
+
+class StoredOrder(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    version: int = Field(SCHEMA_VERSION, alias=VERSION_FIELD)
+    id: str
+    user_id: Optional[str] = Field(None, alias="uid")
+    user_email: Optional[str] = None
+    subscription_plan_id: str = Field(alias="pl")
+    amount_minor: int = Field(alias="amt")
+    currency: str = Field(alias="cur")
+    status: str
+    payment_session_id: Optional[str] = None
+    created_at: datetime
+
+
+class StoredTransaction(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    version: int = Field(SCHEMA_VERSION, alias=VERSION_FIELD)
+    id: str
+    session_id: Optional[str] = None
+    user_id: Optional[str] = Field(None, alias="uid")
+    user_email: Optional[str] = Field(None, alias="em")
+    subscription_plan_id: str = Field(alias="pl")
+    amount_minor: int = Field(alias="amt")
+    currency: str = Field(alias="cur")
+    status: str
+    payment_status: str
+    extra_metadata: Optional[Dict[str, str]] = Field(None, alias="md")
+    provisional_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+def _names_by_alias(model: Type[BaseModel]) -> Dict[str, str]:
+    return {field.alias: name for name, field in model.model_fields.items() if field.alias}
+
+
+# Stored name -> API name, for the fields a v2 document stores under another name
+ORDER_NAMES = {**_names_by_alias(StoredOrder), "amt": "amount"}
+TRANSACTION_NAMES = {**_names_by_alias(StoredTransaction), "amt": "amount", "md": "metadata"}
+
+# Version 1 fields a v2 document no longer has under that name
+ORDER_V1_ONLY = [name for alias, name in ORDER_NAMES.items() if alias != VERSION_FIELD] + ["updated_at"]
+TRANSACTION_V1_ONLY = [name for alias, name in TRANSACTION_NAMES.items() if alias != VERSION_FIELD]
+
+
+def stored_projection(names: Dict[str, str]) -> dict:
+    """Projection entries for the short names, to add to a projection written in API names"""
+    return {alias: 1 for alias in names}
+
+
+def order_document(order: dict) -> dict:
+    """Stored (v2) form of an API-shaped order"""
+    return StoredOrder(**order, amount_minor=to_minor(order["amount"])).model_dump(by_alias=True, exclude_none=True)
+
+
+def transaction_document(transaction: dict) -> dict:
+    """Stored (v2) form of an API-shaped payment transaction"""
+    extra = {
+        key: value for key, value in (transaction.get("metadata") or {}).items()
+        if key not in REDUNDANT_METADATA
+    }
+    return StoredTransaction(
+        **transaction, amount_minor=to_minor(transaction["amount"]), extra_metadata=extra or None
+    ).model_dump(by_alias=True, exclude_none=True)
+
+
+def _from_v2(document: dict, names: Dict[str, str]) -> dict:
+    fields = {names.get(key, key): value for key, value in document.items()}
+    del fields["version"]
+    fields["amount"] = from_minor(fields["amount"])
+    return fields
+
+
+def order_from_document(document: dict) -> dict:
+    """API-shaped order from a stored document of either version"""
+    if document.get(VERSION_FIELD) != SCHEMA_VERSION:
+        return document
+    order = _from_v2(document, ORDER_NAMES)
+    order.setdefault("user_id", None)
+    order.setdefault("user_email", None)
+    order.setdefault("payment_session_id", None)
+    order["updated_at"] = order["created_at"]
+    return order
+
+
+def transaction_from_document(document: dict) -> dict:
+    """API-shaped payment transaction from a stored document of either version.
+
+    ``metadata`` of a v2 document holds only the non-redundant keys; see
+    ``REDUNDANT_METADATA`` for what to fill back in.
+    """
+    if document.get(VERSION_FIELD) != SCHEMA_VERSION:
+        return document
+    transaction = _from_v2(document, TRANSACTION_NAMES)
+    transaction.setdefault("session_id", None)
+    transaction.setdefault("user_id", None)
+    transaction.setdefault("user_email", None)
+    transaction.setdefault("metadata", None)
+    transaction.setdefault("provisional_at", None)
+    transaction.setdefault("expires_at", None)
+    return transaction
+
+
+# Aggregation expressions that read either version
+AMOUNT_EXPRESSION = {"$ifNull": [{"$divide": ["$amt", MINOR_UNITS]}, "$amount"]}
+PLAN_EXPRESSION = {"$ifNull": ["$pl", "$subscription_plan_id"]}
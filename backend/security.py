@@ -0,0 +1,135 @@
+"""Password hashing on a bounded thread pool, with cost-factor tuning.
+
+bcrypt releases the GIL while hashing, so a small thread pool keeps the
+event loop free. ``python security.py tune --target-p99-ms 250`` measures
+login latency under concurrency and recommends PASSWORD_BCRYPT_ROUNDS.
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+class HasherOverloaded(Exception):
+    """Raised when too many hashing requests are already waiting"""
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification off the event loop, with a concurrency limit"""
+
+    def __init__(self, rounds: int = 12, workers: int = 4, max_queue: int = 100):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        # Hashes with a different cost are flagged by verify_and_update and rehashed
+        self.context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds, deprecated="auto")
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "PasswordHasher":
+        return cls(
+            rounds=int(os.environ.get('PASSWORD_BCRYPT_ROUNDS', 12)),
+            workers=int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2)),
+            max_queue=int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 100)),
+        )
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    async def _run(self, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HasherOverloaded(f"{self.queued} password hashes already queued")
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, password_hash: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """Check a password; also returns a new hash when the stored one uses outdated parameters"""
+        if not password_hash:
+            # Spend the same time as a real check so unknown accounts are not revealed
+            await self._run(self.context.dummy_verify)
+            return False, None
+        return await self._run(self.context.verify_and_update, password, password_hash)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+async def measure_login_p99(rounds: int, workers: int, concurrency: int, samples: int) -> float:
+    """p99 latency in ms of verify() for ``samples`` logins, ``concurrency`` at a time"""
+    hasher = PasswordHasher(rounds=rounds, workers=workers, max_queue=samples)
+    password_hash = await hasher.hash("benchmark-password")
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one_login():
+        async with gate:
+            start = time.perf_counter()
+            await hasher.verify("benchmark-password", password_hash)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*[one_login() for _ in range(samples)])
+    hasher.close()
+    latencies.sort()
+    return latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+
+async def tune(target_p99_ms: float, workers: int, concurrency: int, samples: int, min_rounds: int, max_rounds: int) -> int:
+    """Highest bcrypt cost whose login p99 stays within the target"""
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        p99 = await measure_login_p99(rounds, workers, concurrency, samples)
+        within = p99 <= target_p99_ms
+        print(f"rounds={rounds:<3} p99={p99:8.1f} ms {'ok' if within else 'over target'}")
+        if not within:
+            break
+        chosen = rounds
+    return chosen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick a bcrypt cost factor for a target login p99")
+    parser.add_argument("command", choices=["tune"])
+    parser.add_argument("--target-p99-ms", type=float, default=250.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--concurrency", type=int, default=8, help="simultaneous logins")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=15)
+    args = parser.parse_args()
+    rounds = asyncio.run(tune(
+        args.target_p99_ms, args.workers, args.concurrency, args.samples, args.min_rounds, args.max_rounds
+    ))
+    print(f"PASSWORD_BCRYPT_ROUNDS={rounds}")
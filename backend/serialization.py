@@ -0,0 +1,33 @@
+"""Single-pass JSON responses for documents whose shape we already trust.
+
+Orders and users are validated once, by their Pydantic model, when they are
+written. Reads project exactly the model's fields out of Mongo and encode the
+documents straight to bytes with orjson, skipping the model construction and
+``response_model`` re-validation FastAPI would otherwise do on every item.
+"""
+from typing import Any, Type
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def projection_for(model: Type[BaseModel]) -> dict:
+    """Mongo projection returning exactly the model's fields and no ``_id``"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+
+def dumps(content: Any) -> bytes:
+    # Naive datetimes come out exactly as Pydantic writes them, e.g. 2025-01-01T12:00:00.123000
+    return orjson.dumps(content)
+
+
+def dumps_line(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def json_response(content: Any, status_code: int = 200, headers: dict = None) -> Response:
+    return Response(content=dumps(content), status_code=status_code, headers=headers, media_type=JSON_MEDIA_TYPE)
+
@@ -1,29 +1,78 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Query, Depends, Header
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
+import asyncio
+import hmac
+import math
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional, Dict
 import uuid
-from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import smtplib
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from datetime import date, datetime, timedelta
+from emergentintegrations.payments.stripe.checkout import CheckoutSessionRequest
+from catalog import CatalogStore, cached_response
+from indexes import provision_indexes
+from payments import PaymentClient
+from resilience import BREAKER_STATE_VALUES, DependencyUnavailable
+from webhooks import WebhookInbox
+from reconciler import PaymentReconciler
+from idempotency import IdempotencyStore
+from checkout_pipeline import TRANSACTION_ID_KEY, CheckoutPipeline
+from tiering import StorageTiers
+from read_routing import READ_TOKEN_HEADER, ReadRouting
+from schema import (
+    ORDER_NAMES, REDUNDANT_METADATA, order_document, order_from_document, stored_projection,
+    transaction_document, transaction_from_document,
+)
+from checkout_events import SSE_KEEPALIVE, CheckoutEventHub, sse_event
+from fulfillment import OrderFulfillment
+from security import HasherOverloaded, PasswordHasher
+from auth import TokenService, UserCache
+from analytics import AnalyticsCache, RevenueAnalytics
+from metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, GaugeCallback, MetricsMiddleware, MongoCommandTimer
+from jwt import InvalidTokenError
+from mailer import EmailOutbox, SMTPSettings, order_confirmation_message, welcome_message
+from status_cache import StatusCache, is_terminal
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor
+from serialization import JSON_MEDIA_TYPE, dumps, dumps_line, json_response, projection_for
+from structured_logging import RequestIdMiddleware, parse_logger_settings, setup_logging
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Structured JSON logs, written off the event loop by a queue listener thread
+log_pipeline = setup_logging(
+    level=os.environ.get('LOG_LEVEL', 'INFO'),
+    queue_size=int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+    sample_rates=parse_logger_settings(os.environ.get('LOG_SAMPLE_RATES')),
+    rate_limits=parse_logger_settings(os.environ.get('LOG_RATE_LIMITS', 'server=50,payments=20,webhooks=20')),
+)
+logger = logging.getLogger(__name__)
+
+# MongoDB: one client per worker, created by the lifespan with these pool settings
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 10))
+
+def mongo_client_from_env() -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000)),
+        waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+        serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        event_listeners=[MongoCommandTimer()],
+    )
 
-# Create the main app without a prefix
-app = FastAPI(title="Premium Subscription Store", version="1.0.0")
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -70,6 +119,10 @@ class Order(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Orders are validated once on write; reads fetch these fields (API names and
+# the short names of compact documents) and hand them to order_from_document
+ORDER_PROJECTION = {**projection_for(Order), **stored_projection(ORDER_NAMES)}
+
 class PaymentTransaction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     session_id: Optional[str] = None
@@ -81,9 +134,21 @@ class PaymentTransaction(BaseModel):
     status: str = "pending"  # pending, completed, failed, expired
     payment_status: str = "pending"  # pending, paid, failed, expired
     metadata: Optional[Dict[str, str]] = None
+    provisional_at: Optional[datetime] = None  # set until the Stripe session id is recorded
+    expires_at: Optional[datetime] = None  # TTL deletion time while unpaid
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class SubscriptionPlanUpdate(BaseModel):
+    service_name: Optional[str] = None
+    plan_name: Optional[str] = None
+    price: Optional[float] = None
+    currency: Optional[str] = None
+    duration: Optional[str] = None
+    features: Optional[List[str]] = None
+    image_url: Optional[str] = None
+    is_active: Optional[bool] = None
+
 class CheckoutRequest(BaseModel):
     subscription_plan_id: str
     user_email: Optional[str] = None
@@ -165,23 +230,209 @@ SUBSCRIPTION_PLANS = [
     }
 ]
 
+def paid_order_document(payment_transaction: dict, session_id: str) -> dict:
+    """Completed order (as stored) for a paid payment transaction"""
+    payment_transaction = transaction_from_document(payment_transaction)
+    order_obj = Order(
+        user_email=payment_transaction["user_email"],
+        subscription_plan_id=payment_transaction["subscription_plan_id"],
+        amount=payment_transaction["amount"],
+        currency=payment_transaction["currency"],
+        status="completed",
+        payment_session_id=session_id
+    )
+    return order_document(order_obj.model_dump())
+
+async def on_orders_created(orders: List[dict]) -> None:
+    """Drop stale analytics and queue a confirmation email for each new order"""
+    analytics_cache.invalidate()
+    orders = [order_from_document(order) for order in orders]
+    await app.state.email_outbox.enqueue_many([
+        order_confirmation_message(order, catalog.get_plan(order["subscription_plan_id"]))
+        for order in orders if order.get("user_email")
+    ])
+
+# Revenue rollups, cached until the next order is recorded
+analytics_cache = AnalyticsCache(ttl=float(os.environ.get('ANALYTICS_CACHE_TTL', 60.0)))
+
+# Short-lived, single-flight cache of Stripe checkout status lookups
+status_cache = StatusCache(ttl=float(os.environ.get('CHECKOUT_STATUS_CACHE_TTL', 2.0)))
+
+# Database-backed services, created per worker by bind_database()
+catalog: Optional[CatalogStore] = None
+analytics: Optional[RevenueAnalytics] = None
+fulfillment: Optional[OrderFulfillment] = None
+idempotency: Optional[IdempotencyStore] = None
+checkout_pipeline: Optional[CheckoutPipeline] = None
+tiers: Optional[StorageTiers] = None
+routing: Optional[ReadRouting] = None
+
+def bind_database(mongo_client: AsyncIOMotorClient) -> None:
+    """Point this worker's database handle and every service built on it at a new client"""
+    global client, db, catalog, analytics, fulfillment, idempotency, checkout_pipeline, tiers, routing
+    client = mongo_client
+    db = client[os.environ['DB_NAME']]
+    # Order reads and login may go to secondaries (MONGO_READ_PREFERENCE)
+    routing = ReadRouting.from_env(client, os.environ['DB_NAME'])
+    # Plans live in MongoDB (seeded from the list above) and are served from an
+    # in-memory snapshot that is swapped whenever the collection changes
+    catalog = CatalogStore(
+        db,
+        SubscriptionPlan,
+        SUBSCRIPTION_PLANS,
+        poll_interval=float(os.environ.get('CATALOG_POLL_INTERVAL', 5.0)),
+        on_change=lambda: analytics_cache.invalidate(),
+    )
+    analytics = RevenueAnalytics(db, catalog.plans, analytics_cache)
+    # Payment status recording and order creation, shared by every payment path
+    fulfillment = OrderFulfillment(db, paid_order_document, on_orders_created=on_orders_created)
+    # Responses of POSTs made with an Idempotency-Key, replayed on retries
+    idempotency = IdempotencyStore(db, max_entries=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000)))
+    # Writes the payment transaction while Stripe creates the checkout session
+    checkout_pipeline = CheckoutPipeline(db)
+    # Old orders move to orders_archive; abandoned payment transactions expire
+    tiers = StorageTiers(
+        db,
+        archive_after=timedelta(days=30 * float(os.environ.get('ORDER_ARCHIVE_AFTER_MONTHS', 6))),
+        transaction_ttl=timedelta(days=float(os.environ.get('UNPAID_TRANSACTION_TTL_DAYS', 30))),
+        batch_size=int(os.environ.get('ORDER_ARCHIVE_BATCH_SIZE', 500)),
+        pause=float(os.environ.get('ORDER_ARCHIVE_BATCH_PAUSE', 0.5)),
+        interval=float(os.environ.get('ORDER_ARCHIVE_INTERVAL', 3600.0)),
+        read_db=routing.db,
+    )
+
+def read_token_headers(session) -> Dict[str, str]:
+    """Response header that lets the client read its own writes from a secondary"""
+    token = routing.token(session)
+    return {READ_TOKEN_HEADER: token} if token else {}
+
+async def run_idempotent(scope: str, key: Optional[str], payload: BaseModel, handler) -> Response:
+    if not key:
+        return await handler()
+    return await idempotency.run(scope, key, payload.model_dump(), handler)
+
+# Wakes checkout event streams when a session's recorded status changes
+checkout_events = CheckoutEventHub()
+
+def on_checkout_status_changed(session_id: str) -> None:
+    status_cache.invalidate(session_id)
+    checkout_events.publish(session_id)
+
+# Access tokens and the profile cache backing them
+token_service = TokenService.from_env()
+user_cache = UserCache(
+    max_entries=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 300.0)),
+)
+bearer_scheme = HTTPBearer(auto_error=False)
+
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> Optional[User]:
+    """The user a bearer token belongs to, or None for anonymous requests"""
+    if credentials is None:
+        return None
+    unauthorized = HTTPException(
+        status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"}
+    )
+    try:
+        claims = token_service.verify(credentials.credentials)
+    except InvalidTokenError:
+        raise unauthorized
+    
+    user = user_cache.get(claims["sub"])
+    if user is None:
+        user_doc = await db.users.find_one({"id": claims["sub"]}, {"_id": 0, "password_hash": 0})
+        if not user_doc or not user_doc.get("is_active", True):
+            raise unauthorized
+        user = User(**user_doc)
+        user_cache.put(user.id, user)
+    return user
+
+async def get_current_user(user: Optional[User] = Depends(get_optional_user)) -> User:
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+async def require_admin(x_admin_key: Optional[str] = Header(None)) -> None:
+    """Back-office endpoints need the ADMIN_API_KEY in an X-Admin-Key header"""
+    admin_key = os.environ.get('ADMIN_API_KEY')
+    if not admin_key or not x_admin_key or not hmac.compare_digest(x_admin_key, admin_key):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
 # Basic routes
 @api_router.get("/")
 async def root():
     return {"message": "Premium Subscription Store API", "version": "1.0.0"}
 
+@api_router.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker"""
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@api_router.get("/healthz")
+async def healthz():
+    """Liveness probe: the worker is up and its event loop is responsive"""
+    return {"status": "ok"}
+
+@api_router.get("/readyz")
+async def readyz():
+    """Readiness probe: started, not draining, MongoDB reachable and every required index present"""
+    if not app.state.ready:
+        raise HTTPException(status_code=503, detail="Draining" if app.state.draining else "Starting up")
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=float(os.environ.get('READINESS_PING_TIMEOUT', 1.0)))
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"MongoDB unreachable: {e}")
+    missing = app.state.missing_indexes
+    if missing is None:
+        raise HTTPException(status_code=503, detail="Indexes not provisioned yet")
+    if missing:
+        raise HTTPException(
+            status_code=503,
+            detail={"missing_indexes": [f"{spec.collection}.{spec.name}" for spec in missing]}
+        )
+    return {"status": "ready"}
+
 @api_router.get("/subscriptions", response_model=List[SubscriptionPlan])
-async def get_subscriptions():
+async def get_subscriptions(request: Request):
     """Get all available subscription plans"""
-    return [SubscriptionPlan(**plan) for plan in SUBSCRIPTION_PLANS]
+    snapshot = catalog.current
+    return cached_response(request, snapshot.list_body, snapshot.list_etag)
 
 @api_router.get("/subscriptions/{subscription_id}", response_model=SubscriptionPlan)
-async def get_subscription(subscription_id: str):
+async def get_subscription(subscription_id: str, request: Request):
     """Get a specific subscription plan"""
-    plan = next((plan for plan in SUBSCRIPTION_PLANS if plan["id"] == subscription_id), None)
-    if not plan:
+    entry = catalog.get_entry(subscription_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Subscription plan not found")
+    return cached_response(request, entry.body, entry.etag)
+
+@api_router.put("/subscriptions/{subscription_id}", response_model=SubscriptionPlan, dependencies=[Depends(require_admin)])
+async def put_subscription(subscription_id: str, plan: SubscriptionPlan):
+    """Create or replace a subscription plan"""
+    return json_response(await catalog.save_plan({**plan.model_dump(), "id": subscription_id}))
+
+@api_router.patch("/subscriptions/{subscription_id}", response_model=SubscriptionPlan, dependencies=[Depends(require_admin)])
+async def patch_subscription(subscription_id: str, changes: SubscriptionPlanUpdate):
+    """Update some fields of a subscription plan, e.g. its price; null fields are left unchanged"""
+    try:
+        plan = await catalog.update_plan(subscription_id, changes.model_dump(exclude_none=True))
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    if plan is None:
         raise HTTPException(status_code=404, detail="Subscription plan not found")
-    return SubscriptionPlan(**plan)
+    return json_response(plan)
+
+def password_hasher() -> PasswordHasher:
+    return app.state.password_hasher
+
+async def run_hasher(operation):
+    """Await a hashing operation, shedding load with a 503 when the pool is saturated"""
+    try:
+        return await operation
+    except HasherOverloaded:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
 @api_router.post("/users", response_model=User)
 async def create_user(user_data: UserCreate):
@@ -191,28 +442,57 @@ async def create_user(user_data: UserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Create new user (in a real app, password would be hashed)
+    # Create new user; only the password hash is stored
     user_dict = user_data.dict()
-    user_dict.pop('password')  # Remove password from stored data
-    user_obj = User(**user_dict)
-    await db.users.insert_one(user_obj.dict())
-    return user_obj
+    password = user_dict.pop('password')
+    user_doc = User(**user_dict).model_dump()
+    password_hash = await run_hasher(password_hasher().hash(password))
+    async with routing.session() as session:
+        try:
+            await db.users.insert_one({**user_doc, "password_hash": password_hash}, session=session)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Email already registered")
+    await app.state.email_outbox.enqueue_many([welcome_message(user_doc)])
+    return json_response(user_doc, headers=read_token_headers(session))
 
 @api_router.post("/auth/login")
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, response: Response, x_read_token: Optional[str] = Header(None)):
     """User login"""
-    user = await db.users.find_one({"email": user_data.email})
-    if not user:
+    async with routing.session(x_read_token) as session:
+        user = await routing.db.users.find_one({"email": user_data.email}, session=session)
+    response.headers.update(read_token_headers(session))
+    valid, new_hash = await run_hasher(
+        password_hasher().verify(user_data.password, user.get("password_hash") if user else None)
+    )
+    if not user or not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    # In a real app, verify password hash
-    return {"message": "Login successful", "user_id": user["id"]}
+    # Transparently upgrade hashes made with older cost parameters
+    if new_hash:
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password_hash": new_hash}})
+    
+    user_cache.put(user["id"], User(**user))
+    return {
+        "message": "Login successful",
+        "user_id": user["id"],
+        "access_token": token_service.issue(user),
+        "token_type": "bearer",
+        "expires_in": token_service.ttl_seconds
+    }
+
+@api_router.get("/auth/me", response_model=User)
+async def get_me(current_user: User = Depends(get_current_user)):
+    """Profile of the authenticated user"""
+    return json_response(current_user.model_dump())
 
 @api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate):
-    """Create a new order"""
+async def create_order(order_data: OrderCreate, idempotency_key: Optional[str] = Header(None)):
+    """Create a new order; retries with the same Idempotency-Key get the original response"""
+    return await run_idempotent("orders", idempotency_key, order_data, lambda: insert_order(order_data))
+
+async def insert_order(order_data: OrderCreate) -> Response:
     # Validate subscription plan exists
-    plan = next((plan for plan in SUBSCRIPTION_PLANS if plan["id"] == order_data.subscription_plan_id), None)
+    plan = catalog.get_plan(order_data.subscription_plan_id)
     if not plan:
         raise HTTPException(status_code=404, detail="Subscription plan not found")
     
@@ -224,28 +504,49 @@ async def create_order(order_data: OrderCreate):
         "status": "pending"
     })
     
-    order_obj = Order(**order_dict)
-    await db.orders.insert_one(order_obj.dict())
-    return order_obj
+    order_doc = Order(**order_dict).model_dump()
+    body = dumps(order_doc)
+    async with routing.session() as session:
+        await db.orders.insert_one(order_document(order_doc), session=session)
+    analytics_cache.invalidate()
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers=read_token_headers(session))
+
+def get_payment_client() -> PaymentClient:
+    """The worker's shared Stripe client, created at startup"""
+    payments = app.state.payments
+    if payments is None or not payments.configured:
+        raise HTTPException(status_code=500, detail="Stripe API key not configured")
+    return payments
+
+def payment_unavailable(e: DependencyUnavailable) -> HTTPException:
+    """Fast 503 telling the client when the payment provider is worth retrying"""
+    logger.warning("Payment provider call rejected: %s", e.reason)
+    return HTTPException(
+        status_code=503,
+        detail="Payment provider temporarily unavailable, please retry",
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
 
 @api_router.post("/checkout/session")
-async def create_checkout_session(checkout_data: CheckoutRequest, request: Request):
-    """Create a Stripe checkout session"""
+async def create_checkout_session(
+    checkout_data: CheckoutRequest, request: Request, idempotency_key: Optional[str] = Header(None)
+):
+    """Create a Stripe checkout session; retries with the same Idempotency-Key get the original session"""
+    return await run_idempotent(
+        "checkout_session", idempotency_key, checkout_data,
+        lambda: start_checkout_session(checkout_data, str(request.base_url)),
+    )
+
+async def start_checkout_session(checkout_data: CheckoutRequest, host_url: str) -> Response:
     try:
         # Validate subscription plan exists
-        plan = next((plan for plan in SUBSCRIPTION_PLANS if plan["id"] == checkout_data.subscription_plan_id), None)
+        plan = catalog.get_plan(checkout_data.subscription_plan_id)
         if not plan:
             raise HTTPException(status_code=404, detail="Subscription plan not found")
         
-        # Get Stripe API key from environment
-        stripe_api_key = os.environ.get('STRIPE_API_KEY')
-        if not stripe_api_key:
-            raise HTTPException(status_code=500, detail="Stripe API key not configured")
-        
-        # Initialize Stripe checkout
-        host_url = str(request.base_url)
-        webhook_url = f"{host_url}api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+        payments = get_payment_client()
+        # STRIPE_WEBHOOK_URL pins it; otherwise it follows the Host the request came in on
+        webhook_url = payments.webhook_url or f"{host_url}api/webhook/stripe"
         
         # Create success and cancel URLs using origin
         success_url = f"{checkout_data.origin_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
@@ -259,193 +560,489 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
             "service_name": plan["service_name"]
         }
         
-        # Create checkout session with custom amount (security: amount comes from backend)
-        checkout_request = CheckoutSessionRequest(
-            amount=plan["price"],
-            currency=plan["currency"].lower(),
-            success_url=success_url,
-            cancel_url=cancel_url,
-            metadata=metadata
-        )
-        
-        session = await stripe_checkout.create_checkout_session(checkout_request)
-        
-        # Create payment transaction record
+        # Payment transaction record, written while Stripe creates the session
+        now = datetime.utcnow()
         payment_transaction = PaymentTransaction(
-            session_id=session.session_id,
             user_email=checkout_data.user_email,
             subscription_plan_id=checkout_data.subscription_plan_id,
             amount=plan["price"],
             currency=plan["currency"].lower(),
             status="pending",
             payment_status="pending",
-            metadata=metadata
+            metadata=metadata,
+            provisional_at=now,
+            expires_at=tiers.transaction_expiry(now),
+            created_at=now,
+            updated_at=now
         )
         
-        await db.payment_transactions.insert_one(payment_transaction.dict())
+        # Create checkout session with custom amount (security: amount comes from backend)
+        checkout_request = CheckoutSessionRequest(
+            amount=plan["price"],
+            currency=plan["currency"].lower(),
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata={**metadata, TRANSACTION_ID_KEY: payment_transaction.id}
+        )
+        
+        session = await checkout_pipeline.create(
+            transaction_document(payment_transaction.model_dump()),
+            lambda: payments.create_checkout_session(checkout_request, webhook_url),
+        )
         
-        return {"url": session.url, "session_id": session.session_id}
+        return json_response({"url": session.url, "session_id": session.session_id})
         
+    except HTTPException:
+        raise
+    except DependencyUnavailable as e:
+        raise payment_unavailable(e)
     except Exception as e:
-        logger.error(f"Error creating checkout session: {str(e)}")
+        logger.error("Error creating checkout session: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to create checkout session: {str(e)}")
 
+def transaction_metadata(payment_transaction: dict) -> Dict[str, str]:
+    """The Stripe metadata a transaction was created with; compact documents only store what the catalog lacks"""
+    metadata = payment_transaction.get("metadata") or {}
+    if all(key in metadata for key in REDUNDANT_METADATA):
+        return metadata
+    plan = catalog.get_plan(payment_transaction["subscription_plan_id"]) or {}
+    return {
+        "subscription_plan_id": payment_transaction["subscription_plan_id"],
+        "user_email": payment_transaction.get("user_email") or "",
+        "plan_name": plan.get("plan_name", ""),
+        "service_name": plan.get("service_name", ""),
+        **metadata,
+    }
+
+def checkout_status_from_transaction(payment_transaction: dict) -> dict:
+    """Status response for a settled transaction, without asking Stripe"""
+    payment_transaction = transaction_from_document(payment_transaction)
+    return {
+        "status": payment_transaction["status"],
+        "payment_status": payment_transaction["payment_status"],
+        "amount_total": int(round(payment_transaction["amount"] * 100)),
+        "currency": payment_transaction["currency"],
+        "metadata": transaction_metadata(payment_transaction)
+    }
+
+async def refresh_checkout_status(session_id: str, payment_transaction: dict) -> dict:
+    """Fetch the session from Stripe and record any status change"""
+    checkout_status = await get_payment_client().get_checkout_status(session_id)
+    
+    # Only update if status has changed to avoid duplicate processing
+    if (payment_transaction["status"] != checkout_status.status or 
+        payment_transaction["payment_status"] != checkout_status.payment_status):
+        await fulfillment.apply_status(session_id, checkout_status.payment_status, checkout_status.status)
+        checkout_events.publish(session_id)
+    
+    return {
+        "status": checkout_status.status,
+        "payment_status": checkout_status.payment_status,
+        "amount_total": checkout_status.amount_total,
+        "currency": checkout_status.currency,
+        "metadata": checkout_status.metadata
+    }
+
+async def find_payment_transaction(session_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+    """The transaction for a session, waiting out this worker's pending finalization of it"""
+    payment_transaction = await db.payment_transactions.find_one({"session_id": session_id}, projection)
+    if payment_transaction is None and await checkout_pipeline.wait_finalized(session_id):
+        payment_transaction = await db.payment_transactions.find_one({"session_id": session_id}, projection)
+    return payment_transaction
+
+async def current_checkout_status(session_id: str) -> dict:
+    """A session's status: from our record once settled, otherwise from Stripe"""
+    payment_transaction = await find_payment_transaction(session_id)
+    if not payment_transaction:
+        raise HTTPException(status_code=404, detail="Payment transaction not found")
+    
+    # Settled sessions are answered from our own record
+    if is_terminal(payment_transaction):
+        return checkout_status_from_transaction(payment_transaction)
+    
+    # Concurrent polls for the same session share one Stripe call
+    try:
+        return await status_cache.get(
+            session_id, lambda: refresh_checkout_status(session_id, payment_transaction)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Stripe is slow or failing: answer with the last status we recorded
+        logger.warning("Serving recorded checkout status for %s: %s", session_id, e)
+        return checkout_status_from_transaction(payment_transaction)
+
 @api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str):
-    """Get checkout session status"""
+async def get_checkout_status(session_id: str, response: Response):
+    """Get checkout session status; a paid one carries a read token covering its order"""
     try:
-        # Get Stripe API key from environment
-        stripe_api_key = os.environ.get('STRIPE_API_KEY')
-        if not stripe_api_key:
-            raise HTTPException(status_code=500, detail="Stripe API key not configured")
-        
-        # Initialize Stripe checkout
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-        
-        # Get status from Stripe
-        checkout_status = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Find existing payment transaction
-        payment_transaction = await db.payment_transactions.find_one({"session_id": session_id})
-        if not payment_transaction:
-            raise HTTPException(status_code=404, detail="Payment transaction not found")
-        
-        # Update payment transaction status (avoid duplicate processing)
-        update_data = {
-            "status": checkout_status.status,
-            "payment_status": checkout_status.payment_status,
-            "updated_at": datetime.utcnow()
-        }
-        
-        # Only update if status has changed to avoid duplicate processing
-        if (payment_transaction["status"] != checkout_status.status or 
-            payment_transaction["payment_status"] != checkout_status.payment_status):
-            
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {"$set": update_data}
-            )
-            
-            # If payment is successful, create order record
-            if checkout_status.payment_status == "paid" and payment_transaction["status"] != "completed":
-                order_data = {
-                    "user_email": payment_transaction["user_email"],
-                    "subscription_plan_id": payment_transaction["subscription_plan_id"],
-                    "amount": payment_transaction["amount"],
-                    "currency": payment_transaction["currency"],
-                    "status": "completed",
-                    "payment_session_id": session_id
-                }
-                
-                order_obj = Order(**order_data)
-                await db.orders.insert_one(order_obj.dict())
-        
-        return {
-            "status": checkout_status.status,
-            "payment_status": checkout_status.payment_status,
-            "amount_total": checkout_status.amount_total,
-            "currency": checkout_status.currency,
-            "metadata": checkout_status.metadata
-        }
-        
+        checkout_status = await current_checkout_status(session_id)
+        if checkout_status["payment_status"] == "paid" and (token := await routing.primary_token()):
+            response.headers[READ_TOKEN_HEADER] = token
+        return checkout_status
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error getting checkout status: {str(e)}")
+        logger.error("Error getting checkout status: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get checkout status: {str(e)}")
 
+CHECKOUT_EVENTS_RECHECK = float(os.environ.get('CHECKOUT_EVENTS_RECHECK', 10.0))
+CHECKOUT_EVENTS_MAX_DURATION = float(os.environ.get('CHECKOUT_EVENTS_MAX_DURATION', 1800.0))
+
+@api_router.get("/checkout/events/{session_id}")
+async def checkout_events_stream(session_id: str):
+    """Server-Sent Events stream that sends one ``checkout_status`` event once the session settles.
+
+    Sends keepalive comments while waiting, and a ``timeout`` event if the
+    session is still open after CHECKOUT_EVENTS_MAX_DURATION seconds.
+    """
+    if not await find_payment_transaction(session_id, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Payment transaction not found")
+    return StreamingResponse(
+        stream_checkout_events(session_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def stream_checkout_events(session_id: str):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHECKOUT_EVENTS_MAX_DURATION
+    with checkout_events.subscribe(session_id) as channel:
+        while True:
+            # Grab the event before reading, so a change recorded meanwhile still wakes us
+            changed = channel.event
+            try:
+                checkout_status = await current_checkout_status(session_id)
+            except Exception as e:
+                logger.warning("Checkout event stream recheck failed for %s: %s", session_id, e)
+                checkout_status = None
+            if checkout_status and (
+                checkout_status["payment_status"] == "paid" or checkout_status["status"] == "expired"
+            ):
+                if checkout_status["payment_status"] == "paid" and (token := await routing.primary_token()):
+                    # Lets the client's next order listing see the new order on any replica
+                    checkout_status = {**checkout_status, "read_token": token}
+                yield sse_event("checkout_status", checkout_status)
+                return
+            if loop.time() >= deadline:
+                yield sse_event("timeout", {"session_id": session_id})
+                return
+            if app.state.draining:
+                # End the stream; the browser's EventSource reconnects to another worker
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=CHECKOUT_EVENTS_RECHECK)
+            except asyncio.TimeoutError:
+                yield SSE_KEEPALIVE
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     """Handle Stripe webhooks"""
     try:
-        # Get Stripe API key from environment
-        stripe_api_key = os.environ.get('STRIPE_API_KEY')
-        if not stripe_api_key:
-            raise HTTPException(status_code=500, detail="Stripe API key not configured")
-        
-        # Initialize Stripe checkout
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
+        payments = get_payment_client()
         
         # Get webhook body and signature
         body = await request.body()
         signature = request.headers.get("Stripe-Signature")
         
         # Handle webhook
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
+        webhook_response = await payments.handle_webhook(body, signature)
         
-        # Process webhook event
+        # Persist the event and acknowledge; the inbox consumer applies it
         if webhook_response.session_id:
-            # Find payment transaction
-            payment_transaction = await db.payment_transactions.find_one({"session_id": webhook_response.session_id})
-            
-            if payment_transaction:
-                # Update payment transaction
-                update_data = {
-                    "payment_status": webhook_response.payment_status,
-                    "updated_at": datetime.utcnow()
-                }
-                
-                await db.payment_transactions.update_one(
-                    {"session_id": webhook_response.session_id},
-                    {"$set": update_data}
-                )
-                
-                # If payment is successful, create order record
-                if webhook_response.payment_status == "paid":
-                    existing_order = await db.orders.find_one({"payment_session_id": webhook_response.session_id})
-                    if not existing_order:
-                        order_data = {
-                            "user_email": payment_transaction["user_email"],
-                            "subscription_plan_id": payment_transaction["subscription_plan_id"],
-                            "amount": payment_transaction["amount"],
-                            "currency": payment_transaction["currency"],
-                            "status": "completed",
-                            "payment_session_id": webhook_response.session_id
-                        }
-                        
-                        order_obj = Order(**order_data)
-                        await db.orders.insert_one(order_obj.dict())
+            await app.state.webhook_inbox.record(webhook_response)
         
         return {"status": "success"}
         
+    except DependencyUnavailable as e:
+        # Stripe redelivers webhooks that are not acknowledged
+        raise payment_unavailable(e)
     except Exception as e:
-        logger.error(f"Error handling webhook: {str(e)}")
+        logger.error("Error handling webhook: %s", e)
         raise HTTPException(status_code=500, detail=f"Webhook error: {str(e)}")
 
 @api_router.get("/orders/{order_id}", response_model=Order)
-async def get_order(order_id: str):
+async def get_order(order_id: str, x_read_token: Optional[str] = Header(None)):
     """Get order details"""
-    order = await db.orders.find_one({"id": order_id})
+    async with routing.session(x_read_token) as session:
+        order = await tiers.find_order({"id": order_id}, ORDER_PROJECTION, session=session)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    return Order(**order)
+    return json_response(order_from_document(order), headers=read_token_headers(session))
+
+@api_router.get("/analytics/revenue", dependencies=[Depends(require_admin)])
+async def get_revenue_analytics(start: Optional[date] = None, end: Optional[date] = None):
+    """Revenue, orders and checkout conversion by day, plan and service (default: last 30 days)"""
+    return await analytics.revenue(start, end)
+
+@api_router.get("/analytics/plans", dependencies=[Depends(require_admin)])
+async def get_plan_analytics(start: Optional[date] = None, end: Optional[date] = None):
+    """Per-plan revenue, order count, average order value and conversion rate"""
+    return await analytics.plans_summary(start, end)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
 
 @api_router.get("/orders", response_model=List[Order])
-async def get_orders(user_email: Optional[str] = None):
-    """Get orders, optionally filtered by user email"""
+async def get_orders(
+    request: Request,
+    user_email: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    output_format: Optional[str] = Query(None, alias="format"),
+    current_user: Optional[User] = Depends(get_optional_user),
+    x_read_token: Optional[str] = Header(None),
+    x_admin_key: Optional[str] = Header(None),
+):
+    """Get orders newest first.
+
+    Pass a page's X-Next-Cursor header back as ``after`` for the next page;
+    ``format=ndjson`` (or an NDJSON Accept header) streams every order instead.
+    A bearer token lists its own user's orders; listing anyone else's, by
+    ``user_email`` or unscoped for export, needs the X-Admin-Key. Send the
+    latest X-Read-Token response header back to read your own writes.
+    """
     query = {}
-    if user_email:
-        query["user_email"] = user_email
-    
-    orders = await db.orders.find(query).to_list(1000)
-    return [Order(**order) for order in orders]
-
-# Include the router in the main app
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    if current_user:
+        if user_email and user_email != current_user.email:
+            raise HTTPException(status_code=403, detail="Cannot list another user's orders")
+        query["user_email"] = current_user.email
+    elif x_admin_key is not None:
+        await require_admin(x_admin_key)
+        if user_email:
+            query["user_email"] = user_email
+    else:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    if output_format == "ndjson" or NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(stream_orders(query, after, limit, x_read_token), media_type=NDJSON_MEDIA_TYPE)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+    # Recent pages come from the hot collection alone; older ones merge in the archive
+    page_size = limit or DEFAULT_PAGE_SIZE
+    async with routing.session(x_read_token) as session:
+        orders = await tiers.orders_page(query, after, ORDER_PROJECTION, page_size + 1, session=session)
+    headers = read_token_headers(session)
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        headers["X-Next-Cursor"] = encode_cursor(orders[-1])
+    return json_response([order_from_document(order) for order in orders], headers=headers)
+
+async def stream_orders(query: dict, after: Optional[str], limit: Optional[int], read_token: Optional[str]):
+    """Yield orders as NDJSON lines, one batch in memory at a time"""
+    # The session lives as long as the stream, not just the request handler
+    async with routing.session(read_token) as session:
+        async for order in tiers.stream_orders(query, after, ORDER_PROJECTION, limit, session=session):
+            yield dumps_line(order_from_document(order))
+
+# Scrape-time gauges for in-process queues and caches
+REGISTRY.register(GaugeCallback(
+    "password_hash_queue", "Password hashing requests by state", ["state"],
+    lambda: [((state,), value) for state, value in app.state.password_hasher.stats().items()]
+    if app.state.password_hasher else [],
+))
+def stripe_policy_stats() -> Optional[dict]:
+    payments = app.state.payments
+    return payments.policy.stats() if payments is not None else None
+
+REGISTRY.register(GaugeCallback(
+    "stripe_circuit_breaker_state", "Stripe circuit breaker state (0 closed, 1 half-open, 2 open)", [],
+    lambda: [((), BREAKER_STATE_VALUES[stats["state"]])] if (stats := stripe_policy_stats()) else [],
+))
+REGISTRY.register(GaugeCallback(
+    "stripe_calls_in_flight", "Stripe calls currently holding a bulkhead slot", [],
+    lambda: [((), stats["in_flight"])] if (stats := stripe_policy_stats()) else [],
+))
+REGISTRY.register(GaugeCallback(
+    "stripe_calls_rejected_total", "Stripe calls failed fast by the resilience policy", ["reason"],
+    lambda: [((reason,), count) for reason, count in (stripe_policy_stats() or {}).get("rejections", {}).items()],
+    kind="counter",
+))
+REGISTRY.register(GaugeCallback(
+    "checkout_event_streams", "Open checkout status event streams", [],
+    lambda: [((), checkout_events.subscribers())],
+))
+REGISTRY.register(GaugeCallback(
+    "log_records_dropped_total", "Log records discarded before reaching the log writer", ["reason"],
+    lambda: [((reason,), count) for reason, count in log_pipeline.dropped().items()], kind="counter",
+))
+REGISTRY.register(GaugeCallback(
+    "log_queue_depth", "Log records waiting for the writer thread", [],
+    lambda: [((), log_pipeline.queue_depth())],
+))
+REGISTRY.register(GaugeCallback(
+    "idempotent_replays_total", "POST requests answered from a stored Idempotency-Key response", [],
+    lambda: [((), idempotency.replays)] if idempotency else [], kind="counter",
+))
+REGISTRY.register(GaugeCallback(
+    "checkout_finalizations_pending", "Checkout sessions created whose transaction is not yet finalized", [],
+    lambda: [((), checkout_pipeline.pending())] if checkout_pipeline else [],
+))
+REGISTRY.register(GaugeCallback(
+    "user_cache_lookups_total", "User profile cache lookups by result", ["result"],
+    lambda: [(("hit",), user_cache.hits), (("miss",), user_cache.misses)], kind="counter",
+))
+
+async def provision_db_indexes(app: FastAPI):
+    app.state.missing_indexes = await provision_indexes(db)
+
+async def start_catalog(app: FastAPI):
+    await catalog.start()
+
+async def start_payment_client(app: FastAPI):
+    app.state.payments = PaymentClient.from_env()
+    app.state.payments.start()
+
+async def start_password_hasher(app: FastAPI):
+    app.state.password_hasher = PasswordHasher.from_env()
+
+async def start_webhook_inbox(app: FastAPI):
+    app.state.webhook_inbox = WebhookInbox(
+        db,
+        fulfillment,
+        batch_size=int(os.environ.get('WEBHOOK_BATCH_SIZE', 100)),
+        poll_interval=float(os.environ.get('WEBHOOK_POLL_INTERVAL', 1.0)),
+        max_attempts=int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 5)),
+        on_status_changed=on_checkout_status_changed,
+    )
+    app.state.webhook_inbox.start()
+
+async def start_email_outbox(app: FastAPI):
+    app.state.email_outbox = EmailOutbox(
+        db,
+        SMTPSettings.from_env(),
+        workers=int(os.environ.get('SMTP_POOL_SIZE', 2)),
+        batch_size=int(os.environ.get('EMAIL_BATCH_SIZE', 50)),
+    )
+    app.state.email_outbox.start()
+
+async def start_payment_reconciler(app: FastAPI):
+    interval = float(os.environ.get('PAYMENT_RECONCILE_INTERVAL', 60.0))
+    if interval <= 0 or not app.state.payments.configured:
+        return
+    app.state.reconciler = PaymentReconciler(
+        db,
+        lambda: app.state.payments,
+        fulfillment,
+        stale_after=float(os.environ.get('PAYMENT_RECONCILE_STALE_AFTER', 600.0)),
+        batch_size=int(os.environ.get('PAYMENT_RECONCILE_BATCH_SIZE', 200)),
+        concurrency=int(os.environ.get('PAYMENT_RECONCILE_CONCURRENCY', 8)),
+        interval=interval,
+        on_status_changed=on_checkout_status_changed,
+    )
+    app.state.reconciler.start()
+
+async def start_storage_tiering(app: FastAPI):
+    if tiers.interval > 0:
+        tiers.start()
+
+async def stop_catalog(app: FastAPI):
+    await catalog.stop()
+
+async def stop_webhook_inbox(app: FastAPI):
+    if app.state.webhook_inbox is not None:
+        await app.state.webhook_inbox.stop()
+
+async def stop_payment_reconciler(app: FastAPI):
+    if app.state.reconciler is not None:
+        await app.state.reconciler.stop()
+
+async def stop_email_outbox(app: FastAPI):
+    if app.state.email_outbox is not None:
+        await app.state.email_outbox.stop()
+
+async def stop_storage_tiering(app: FastAPI):
+    await tiers.stop()
+
+async def stop_checkout_pipeline(app: FastAPI):
+    await checkout_pipeline.stop()
+
+async def stop_password_hasher(app: FastAPI):
+    if app.state.password_hasher is not None:
+        app.state.password_hasher.close()
+
+async def shutdown_payment_client(app: FastAPI):
+    if app.state.payments is not None:
+        app.state.payments.close()
+
+async def shutdown_db_client(app: FastAPI):
+    client.close()
+
+async def warm_up_mongo(app: FastAPI):
+    """Open the pool's minimum connections before taking traffic, so the first requests don't pay for them"""
+    await asyncio.gather(*[db.command("ping") for _ in range(max(1, MONGO_MIN_POOL_SIZE))])
+
+STARTUP_STEPS = [
+    warm_up_mongo, provision_db_indexes, start_catalog, start_payment_client, start_password_hasher,
+    start_webhook_inbox, start_email_outbox, start_payment_reconciler, start_storage_tiering,
+]
+SHUTDOWN_STEPS = [
+    stop_catalog, stop_storage_tiering, stop_checkout_pipeline, stop_webhook_inbox, stop_payment_reconciler, stop_email_outbox,
+    stop_password_hasher, shutdown_payment_client, shutdown_db_client,
+]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker startup, then a graceful drain and shutdown.
+
+    The worker only reports ready once MongoDB connections are open, indexes
+    are checked and every background task is running. On shutdown it stops
+    reporting ready, ends checkout event streams (clients reconnect to another
+    worker), lets the background consumers finish their batches and closes
+    its clients.
+    """
+    bind_database(app.state.mongo_client_factory())
+    for step in STARTUP_STEPS:
+        await step(app)
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        app.state.draining = True
+        checkout_events.wake_all()
+        for step in SHUTDOWN_STEPS:
+            try:
+                await step(app)
+            except Exception as e:
+                logger.error("Shutdown step %s failed: %s", step.__name__, e)
+
+def create_app() -> FastAPI:
+    """The ASGI app for one worker; run several per box with, for example
+
+        uvicorn server:app --workers 4 --timeout-graceful-shutdown 30
+
+    On SIGTERM uvicorn stops accepting connections and waits for in-flight
+    requests (checkouts included) before the lifespan shutdown runs; the
+    timeout bounds how long long-lived event streams can hold it up.
+    """
+    app = FastAPI(title="Premium Subscription Store", version="1.0.0", lifespan=lifespan)
+    app.state.mongo_client_factory = mongo_client_from_env
+    app.state.ready = False  # true between startup and the start of shutdown
+    app.state.draining = False  # set when shutdown begins
+    app.state.missing_indexes = None  # set by the startup index provisioning step
+    app.state.payments = None  # shared Stripe client, created at startup
+    app.state.webhook_inbox = None  # webhook inbox consumer, started at startup
+    app.state.email_outbox = None  # transactional email sender, started at startup
+    app.state.reconciler = None  # stale checkout session reconciler, started at startup
+    app.state.password_hasher = None  # bounded bcrypt thread pool, created at startup
+
+    app.include_router(api_router)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[READ_TOKEN_HEADER],
+    )
+
+    app.add_middleware(
+        MetricsMiddleware,
+        slow_threshold_ms=float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000)),
+        slow_sample_rate=float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 0.0)),
+    )
+
+    # Outermost, so every log line of a request carries its id
+    app.add_middleware(RequestIdMiddleware)
+    return app
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+app = create_app()
\ No newline at end of file
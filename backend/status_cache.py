@@ -0,0 +1,54 @@
+"""Single-flight, short-TTL cache for checkout status lookups."""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+TERMINAL_PAYMENT_STATUSES = {"paid"}
+TERMINAL_SESSION_STATUSES = {"expired"}
+
+
+def is_terminal(payment_transaction: dict) -> bool:
+    """True once a transaction can no longer change on Stripe's side"""
+    return (
+        payment_transaction.get("payment_status") in TERMINAL_PAYMENT_STATUSES
+        or payment_transaction.get("status") in TERMINAL_SESSION_STATUSES
+    )
+
+
+class StatusCache:
+    """Coalesces concurrent lookups per key into one upstream call and keeps the result briefly"""
+
+    def __init__(self, ttl: float = 2.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _store(self, key: str, value: Any) -> None:
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+            while len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (now + self.ttl, value)
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # A cancelled caller must not cancel the upstream call others wait on
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
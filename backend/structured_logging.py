@@ -0,0 +1,206 @@
+"""Non-blocking JSON logging with request-id correlation.
+
+Application threads only put records on a bounded queue; a
+``QueueListener`` thread formats them as JSON lines and does the I/O. When
+the queue is full, records are dropped and counted rather than blocking
+the event loop. Per-logger sampling (below WARNING) and token-bucket rate
+limits run before a record is queued, so a storm of identical errors costs
+almost nothing.
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+REQUEST_ID_HEADER = "x-request-id"
+
+
+def parse_logger_settings(value: Optional[str]) -> Dict[str, float]:
+    """Parse ``"name=value,other.name=value"`` into a dict"""
+    settings = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, number = item.split("=", 1)
+            settings[name.strip()] = float(number)
+    return settings
+
+
+def _setting_for(settings: Dict[str, float], logger_name: str) -> Optional[float]:
+    """Most specific setting for a logger, walking up its dotted parents"""
+    name = logger_name
+    while True:
+        if name in settings:
+            return settings[name]
+        if "." not in name:
+            return None
+        name = name.rsplit(".", 1)[0]
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Drops a share of low-severity records and rate-limits each logger"""
+
+    def __init__(self, sample_rates: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self.dropped: Dict[str, int] = defaultdict(int)
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def _take_token(self, name: str, per_second: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = [per_second, now]
+            tokens = min(per_second, bucket[0] + (now - bucket[1]) * per_second)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+            return True
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            rate = _setting_for(self.sample_rates, record.name)
+            if rate is not None and random.random() >= rate:
+                self.dropped["sampled"] += 1
+                return False
+        per_second = _setting_for(self.rate_limits, record.name)
+        if per_second is not None and not self._take_token(record.name, per_second):
+            self.dropped["rate_limited"] += 1
+            return False
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Enqueues without ever blocking; counts what did not fit"""
+
+    def __init__(self, log_queue: queue.Queue, sampling: SamplingFilter):
+        super().__init__(log_queue)
+        self.sampling = sampling
+        self.addFilter(sampling)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve everything that depends on the caller (arguments, traceback,
+        # request id) here; JSON encoding and I/O happen on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.sampling.dropped["queue_full"] += 1
+
+
+class LogPipeline:
+    def __init__(self, handler: BoundedQueueHandler, listener: QueueListener):
+        self.handler = handler
+        self.listener = listener
+        self._stopped = False
+
+    def dropped(self) -> Dict[str, int]:
+        return dict(self.handler.sampling.dropped)
+
+    def queue_depth(self) -> int:
+        return self.handler.queue.qsize()
+
+    def stop(self) -> None:
+        """Flush what is queued and stop the listener thread"""
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+
+def setup_logging(
+    level: str = "INFO",
+    queue_size: int = 10000,
+    sample_rates: Optional[Dict[str, float]] = None,
+    rate_limits: Optional[Dict[str, float]] = None,
+) -> LogPipeline:
+    """Route the root logger through a bounded queue to a JSON stderr writer"""
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    handler = BoundedQueueHandler(log_queue, SamplingFilter(sample_rates or {}, rate_limits or {}))
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener.start()
+
+    pipeline = LogPipeline(handler, listener)
+    atexit.register(pipeline.stop)
+    return pipeline
+
+
+class RequestIdMiddleware:
+    """ASGI middleware: adopt the caller's X-Request-ID or mint one, and echo it back"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
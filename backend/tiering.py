@@ -0,0 +1,201 @@
+"""Hot/cold tiering for orders and expiry of abandoned payment transactions.
+
+Orders older than ``archive_after`` are moved in throttled batches from
+``orders`` into ``orders_archive``, so the collection that user order lists
+hit stays small. Reads fall through: a single order is looked up in the
+archive when it is not hot, and order lists only touch the archive once a
+page reaches back past the archiving cutoff. Everything archived is older
+than the cutoff, so newer pages are served from ``orders`` alone.
+
+Payment transactions carry ``expires_at`` until they are paid, and a TTL
+index deletes them once it passes; transactions written before the field
+existed are backfilled in batches by the same background job, which also
+rolls up daily checkout session counts for analytics before they expire.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from analytics import rollup_checkout_sessions
+from pagination import KEYSET_SORT, keyset_query
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def _keyset_key(order: dict):
+    return order["created_at"], order["id"]
+
+
+def _dedupe(orders) -> List[dict]:
+    """Drop the second copy of an order caught in both tiers mid-move (copies sort together)"""
+    unique: List[dict] = []
+    for order in orders:
+        if not unique or unique[-1]["id"] != order["id"]:
+            unique.append(order)
+    return unique
+
+
+async def _next(cursor) -> Optional[dict]:
+    try:
+        return await cursor.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class StorageTiers:
+    """Reads across ``orders``/``orders_archive`` and the background job that fills the archive"""
+
+    def __init__(
+        self,
+        db,
+        archive_after: timedelta = timedelta(days=180),
+        transaction_ttl: timedelta = timedelta(days=30),
+        batch_size: int = 500,
+        pause: float = 0.5,
+        interval: float = 3600.0,
+        read_db=None,
+    ):
+        self.db = db
+        self.read_db = read_db if read_db is not None else db  # where order reads are routed
+        self.archive_after = archive_after
+        self.transaction_ttl = transaction_ttl
+        self.batch_size = batch_size
+        self.pause = pause  # between batches, so archiving never saturates the primary
+        self.interval = interval
+        self._backfilled = False
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        """Orders created before this are archived, or about to be"""
+        return (now or datetime.utcnow()) - self.archive_after
+
+    def transaction_expiry(self, created_at: datetime) -> datetime:
+        return created_at + self.transaction_ttl
+
+    async def find_order(self, query: dict, projection: Optional[dict] = None, session=None) -> Optional[dict]:
+        order = await self.read_db.orders.find_one(query, projection, session=session)
+        if order is None:
+            order = await self.read_db.orders_archive.find_one(query, projection, session=session)
+        return order
+
+    async def orders_page(
+        self, query: dict, after: Optional[str], projection: dict, limit: int, session=None
+    ) -> List[dict]:
+        """Up to ``limit`` orders after the cursor, newest first, from whichever tiers hold them"""
+        query = keyset_query(query, after)
+        hot = await self.read_db.orders.find(query, projection, session=session) \
+            .sort(KEYSET_SORT).limit(limit).to_list(limit)
+        if len(hot) == limit and hot[-1]["created_at"] >= self.cutoff():
+            return hot
+        cold = await self.read_db.orders_archive.find(query, projection, session=session) \
+            .sort(KEYSET_SORT).limit(limit).to_list(limit)
+        return _dedupe(heapq.merge(hot, cold, key=_keyset_key, reverse=True))[:limit]
+
+    async def stream_orders(
+        self, query: dict, after: Optional[str], projection: dict, limit: Optional[int] = None, session=None
+    ) -> AsyncIterator[dict]:
+        """Every order after the cursor, newest first, merging both tiers one batch at a time"""
+        query = keyset_query(query, after)
+        hot_cursor = self.read_db.orders.find(query, projection, session=session).sort(KEYSET_SORT)
+        cold_cursor = self.read_db.orders_archive.find(query, projection, session=session).sort(KEYSET_SORT)
+        if limit:
+            hot_cursor, cold_cursor = hot_cursor.limit(limit), cold_cursor.limit(limit)
+        hot, cold = await _next(hot_cursor), await _next(cold_cursor)
+        sent, last_id = 0, None
+        while (hot is not None or cold is not None) and not (limit and sent >= limit):
+            if cold is None or (hot is not None and _keyset_key(hot) >= _keyset_key(cold)):
+                order, hot = hot, await _next(hot_cursor)
+            else:
+                order, cold = cold, await _next(cold_cursor)
+            if order["id"] != last_id:
+                yield order
+                sent += 1
+            last_id = order["id"]
+
+    async def archive_orders_once(self) -> int:
+        """Move every order older than the cutoff into the archive, one batch at a time"""
+        cutoff = self.cutoff()
+        moved = 0
+        while not self._stopping.is_set():
+            batch = await self.db.orders.find({"created_at": {"$lt": cutoff}}) \
+                .sort([("created_at", ASCENDING)]).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+            # Copy first, then delete: a crash in between leaves an order in both
+            # tiers (reads dedupe it) and the next pass finishes the move
+            try:
+                await self.db.orders_archive.bulk_write(
+                    [ReplaceOne({"id": order["id"]}, order, upsert=True) for order in batch], ordered=False
+                )
+            except BulkWriteError as e:
+                # Another worker archiving the same batch won the upsert
+                if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                    raise
+            await self.db.orders.delete_many({"_id": {"$in": [order["_id"] for order in batch]}})
+            moved += len(batch)
+            if len(batch) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        return moved
+
+    async def backfill_transaction_expiry_once(self) -> int:
+        """Give unpaid transactions written before ``expires_at`` existed their expiry.
+
+        New transactions are written with it, so once a pass finds nothing
+        left this worker stops looking.
+        """
+        backfilled = 0
+        while not self._backfilled and not self._stopping.is_set():
+            batch = await self.db.payment_transactions.find(
+                {"expires_at": {"$exists": False}, "payment_status": {"$ne": "paid"}},
+                {"_id": 1, "created_at": 1},
+            ).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                self._backfilled = True
+                break
+            await self.db.payment_transactions.bulk_write([
+                UpdateOne(
+                    {"_id": tx["_id"], "payment_status": {"$ne": "paid"}},
+                    {"$set": {"expires_at": self.transaction_expiry(tx["created_at"])}},
+                )
+                for tx in batch
+            ], ordered=False)
+            backfilled += len(batch)
+            if len(batch) < self.batch_size:
+                self._backfilled = True
+                break
+            await asyncio.sleep(self.pause)
+        return backfilled
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await rollup_checkout_sessions(self.db, self.transaction_ttl)
+                moved = await self.archive_orders_once()
+                backfilled = await self.backfill_transaction_expiry_once()
+                if moved or backfilled:
+                    logger.info("Archived %d orders; set expiry on %d payment transactions", moved, backfilled)
+            except Exception as e:
+                logger.error("Storage tiering error: %s", e)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop after the current batch"""
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
@@ -0,0 +1,184 @@
+"""Durable webhook inbox: fast acknowledgement, batched background processing."""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Inbox document states
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+class WebhookInbox:
+    """Stores verified Stripe events, deduplicated by event id, and applies them in batches"""
+
+    def __init__(
+        self,
+        db,
+        fulfillment,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        claim_timeout: float = 60.0,
+        max_attempts: int = 5,
+        on_status_changed: Optional[Callable[[str], None]] = None,
+    ):
+        self.db = db
+        self.fulfillment = fulfillment
+        self.on_status_changed = on_status_changed
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def record(self, event) -> bool:
+        """Persist an event for processing; False if it was already received"""
+        event_id = event.event_id or f"{event.session_id}:{event.payment_status}"
+        try:
+            await self.db.webhook_events.insert_one({
+                "event_id": event_id,
+                "event_type": event.event_type,
+                "session_id": event.session_id,
+                "payment_status": event.payment_status,
+                # Finds a transaction whose session id has not been recorded yet
+                "transaction_id": (event.metadata or {}).get("transaction_id"),
+                "status": PENDING,
+                "attempts": 0,
+                "received_at": datetime.utcnow(),
+            })
+        except DuplicateKeyError:
+            return False
+        self._wakeup.set()
+        return True
+
+    async def _claim_batch(self) -> List[dict]:
+        now = datetime.utcnow()
+        claimable = {"$or": [
+            {"status": PENDING},
+            {"status": PROCESSING, "claimed_at": {"$lt": now - timedelta(seconds=self.claim_timeout)}},
+        ]}
+        candidates = await self.db.webhook_events.find(claimable, {"_id": 1}) \
+            .sort("received_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        # Another worker may claim some of the same candidates first; the
+        # claim token tells us which ones ended up ours.
+        claim = uuid.uuid4().hex
+        ids = [doc["_id"] for doc in candidates]
+        await self.db.webhook_events.update_many(
+            {"_id": {"$in": ids}, **claimable},
+            {"$set": {"status": PROCESSING, "claim": claim, "claimed_at": now}},
+        )
+        return await self.db.webhook_events.find({"_id": {"$in": ids}, "claim": claim}) \
+            .sort("received_at", 1).to_list(self.batch_size)
+
+    async def _apply(self, events: List[dict]) -> None:
+        session_ids = list({event["session_id"] for event in events if event.get("session_id")})
+        transactions = {
+            doc["session_id"]: doc
+            async for doc in self.db.payment_transactions.find({"session_id": {"$in": session_ids}})
+        }
+        # Sessions whose provisional transaction was never finalized: adopt it by id
+        unlinked = {
+            event["transaction_id"]: event["session_id"] for event in events
+            if event.get("session_id") and event["session_id"] not in transactions and event.get("transaction_id")
+        }
+        if unlinked:
+            async for doc in self.db.payment_transactions.find({"id": {"$in": list(unlinked)}, "session_id": None}):
+                doc["session_id"] = unlinked[doc["id"]]
+                transactions[doc["session_id"]] = doc
+        now = datetime.utcnow()
+        transaction_ops, paid_transactions, updated_sessions = [], [], set()
+        for event in events:
+            transaction = transactions.get(event.get("session_id"))
+            if not transaction:
+                continue
+            update = self.fulfillment.status_update(event["payment_status"], now=now)
+            if transaction.get("provisional_at") is not None:
+                update["$set"]["session_id"] = event["session_id"]
+                update.setdefault("$unset", {})["provisional_at"] = ""
+                transaction["provisional_at"] = None
+            transaction_ops.append(UpdateOne(
+                {"_id": transaction["_id"], **self.fulfillment.status_filter(event["payment_status"])}, update
+            ))
+            updated_sessions.add(event["session_id"])
+            if event["payment_status"] == "paid":
+                paid_transactions.append(transaction)
+        if transaction_ops:
+            await self.db.payment_transactions.bulk_write(transaction_ops, ordered=True)
+        await self.fulfillment.materialize_orders(paid_transactions)
+        if self.on_status_changed is not None:
+            for session_id in updated_sessions:
+                self.on_status_changed(session_id)
+
+    async def drain_once(self) -> int:
+        """Process one batch; returns the number of events handled"""
+        events = await self._claim_batch()
+        if not events:
+            return 0
+        try:
+            await self._apply(events)
+            done, errors = events, {}
+        except Exception as e:
+            # Find the bad events one at a time so they cannot hold up the rest;
+            # reapplying what the failed batch already wrote is harmless
+            logger.error("Error processing %d webhook events, retrying them one by one: %s", len(events), e)
+            done, errors = [], {}
+            for event in events:
+                try:
+                    await self._apply([event])
+                    done.append(event)
+                except Exception as e:
+                    errors[event["_id"]] = e
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne({"_id": event["_id"]}, {"$set": {"status": DONE, "processed_at": now}}) for event in done
+        ]
+        for event in events:
+            if event["_id"] not in errors:
+                continue
+            attempts = event.get("attempts", 0) + 1
+            status = FAILED if attempts >= self.max_attempts else PENDING
+            logger.warning("Webhook event %s failed (attempt %d): %s", event["event_id"], attempts, errors[event["_id"]])
+            operations.append(UpdateOne({"_id": event["_id"]}, {
+                "$set": {"status": status, "attempts": attempts, "last_error": str(errors[event["_id"]])},
+                "$unset": {"claim": ""},
+            }))
+        await self.db.webhook_events.bulk_write(operations, ordered=False)
+        return len(done)
+
+    async def run(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                if await self.drain_once() == self.batch_size:
+                    continue
+            except Exception as e:
+                logger.error("Webhook inbox consumer error: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop the consumer after the current batch, then drain what is left"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while await self.drain_once():
+            pass
@@ -7,12 +7,16 @@ Tests all backend endpoints including Stripe payment integration
 import asyncio
 import aiohttp
 import json
+import os
 import uuid
 from datetime import datetime
 from typing import Dict, Any, Optional
 
-# Configuration
-BASE_URL = "https://20e69d05-9a30-474e-a7e0-dcd0d14a7f62.preview.emergentagent.com/api"
+# Configuration (for local load and latency benchmarks see backend/loadtest.py)
+BASE_URL = os.environ.get(
+    "BACKEND_TEST_URL",
+    "https://20e69d05-9a30-474e-a7e0-dcd0d14a7f62.preview.emergentagent.com/api"
+)
 
 class BackendTester:
     def __init__(self):
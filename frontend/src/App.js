@@ -5,6 +5,30 @@ import axios from "axios";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Reads may be served by a database replica. Echo the newest X-Read-Token back
+// so they include what this browser just wrote; kept in sessionStorage so it
+// survives the round trip through Stripe checkout.
+const READ_TOKEN_KEY = 'readToken';
+
+const rememberReadToken = (token) => {
+  if (token) {
+    sessionStorage.setItem(READ_TOKEN_KEY, token);
+  }
+};
+
+axios.interceptors.request.use((config) => {
+  const token = sessionStorage.getItem(READ_TOKEN_KEY);
+  if (token) {
+    config.headers['X-Read-Token'] = token;
+  }
+  return config;
+});
+
+axios.interceptors.response.use((response) => {
+  rememberReadToken(response.headers['x-read-token']);
+  return response;
+});
+
 function App() {
   const [subscriptions, setSubscriptions] = useState([]);
   const [user, setUser] = useState(null);
@@ -18,10 +42,25 @@ function App() {
     // Check if user is logged in (simple check)
     const savedUser = localStorage.getItem('user');
     if (savedUser) {
-      setUser(JSON.parse(savedUser));
+      const parsedUser = JSON.parse(savedUser);
+      if (parsedUser.token) {
+        setAuthToken(parsedUser.token);
+        setUser(parsedUser);
+      } else {
+        // Saved before logins issued access tokens
+        expireSession();
+      }
     }
   }, []);
 
+  const setAuthToken = (token) => {
+    if (token) {
+      axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
+    } else {
+      delete axios.defaults.headers.common['Authorization'];
+    }
+  };
+
   const fetchSubscriptions = async () => {
     try {
       const response = await axios.get(`${API}/subscriptions`);
@@ -36,11 +75,12 @@ function App() {
   const handleLogin = async (email, password) => {
     try {
       const response = await axios.post(`${API}/auth/login`, { email, password });
-      const userData = { email, id: response.data.user_id };
+      const userData = { email, id: response.data.user_id, token: response.data.access_token };
+      setAuthToken(userData.token);
       setUser(userData);
       localStorage.setItem('user', JSON.stringify(userData));
       setShowLogin(false);
-      fetchUserOrders(email);
+      fetchUserOrders();
     } catch (error) {
       alert('Login failed: ' + error.response?.data?.detail || 'Unknown error');
     }
@@ -48,26 +88,30 @@ function App() {
 
   const handleSignup = async (email, password, firstName, lastName) => {
     try {
-      const response = await axios.post(`${API}/users`, {
+      await axios.post(`${API}/users`, {
         email,
         password,
         first_name: firstName,
         last_name: lastName
       });
-      const userData = { email, id: response.data.id };
-      setUser(userData);
-      localStorage.setItem('user', JSON.stringify(userData));
       setShowSignup(false);
+      // Log straight in to obtain an access token
+      await handleLogin(email, password);
     } catch (error) {
       alert('Signup failed: ' + error.response?.data?.detail || 'Unknown error');
     }
   };
 
-  const fetchUserOrders = async (email) => {
+  const fetchUserOrders = async () => {
     try {
-      const response = await axios.get(`${API}/orders?user_email=${email}`);
+      // Orders are scoped to the user in the access token
+      const response = await axios.get(`${API}/orders`);
       setOrders(response.data);
     } catch (error) {
+      if (error.response?.status === 401) {
+        expireSession();
+        return;
+      }
       console.error('Error fetching orders:', error);
     }
   };
@@ -108,45 +152,46 @@ function App() {
   };
 
   // Function to poll payment status
-  const pollPaymentStatus = async (sessionId, attempts = 0) => {
-    const maxAttempts = 5;
-    const pollInterval = 2000; // 2 seconds
+  // The server pushes a single event once the payment settles
+  const watchPaymentStatus = (sessionId) => {
+    const events = new EventSource(`${API}/checkout/events/${sessionId}`);
 
-    if (attempts >= maxAttempts) {
-      alert('Payment status check timed out. Please check your email for confirmation.');
-      return;
-    }
-
-    try {
-      const response = await axios.get(`${API}/checkout/status/${sessionId}`);
-      
-      if (response.data.payment_status === 'paid') {
+    events.addEventListener('checkout_status', (event) => {
+      events.close();
+      const status = JSON.parse(event.data);
+      rememberReadToken(status.read_token);
+      if (status.payment_status === 'paid') {
         alert('Payment successful! Thank you for your purchase.');
         // Refresh orders if user is logged in
         if (user) {
-          fetchUserOrders(user.email);
+          fetchUserOrders();
         }
         // Remove session_id from URL
         window.history.replaceState({}, document.title, window.location.pathname);
-        return;
-      } else if (response.data.status === 'expired') {
+      } else if (status.status === 'expired') {
         alert('Payment session expired. Please try again.');
-        return;
       }
+    });
 
-      // If payment is still pending, continue polling
-      setTimeout(() => pollPaymentStatus(sessionId, attempts + 1), pollInterval);
-    } catch (error) {
-      console.error('Error checking payment status:', error);
-      alert('Error checking payment status. Please try again.');
-    }
+    events.addEventListener('timeout', () => {
+      events.close();
+      alert('Payment status check timed out. Please check your email for confirmation.');
+    });
+
+    events.onerror = () => {
+      // EventSource retries dropped connections itself; give up only once it has closed
+      if (events.readyState === EventSource.CLOSED) {
+        console.error('Error checking payment status');
+        alert('Error checking payment status. Please try again.');
+      }
+    };
   };
 
   // Check if we're returning from Stripe
   const checkReturnFromStripe = () => {
     const sessionId = getUrlParameter('session_id');
     if (sessionId) {
-      pollPaymentStatus(sessionId);
+      watchPaymentStatus(sessionId);
     }
   };
 
@@ -157,10 +202,18 @@ function App() {
 
   const handleLogout = () => {
     setUser(null);
+    setAuthToken(null);
     localStorage.removeItem('user');
     setOrders([]);
   };
 
+  // Missing or expired access token: start over from the login form
+  const expireSession = () => {
+    handleLogout();
+    setShowLogin(true);
+    alert('Your session has expired. Please log in again.');
+  };
+
   if (loading) {
     return (
       <div className="min-h-screen flex items-center justify-center bg-gray-50">
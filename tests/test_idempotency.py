@@ -0,0 +1,219 @@
+"""Idempotency-Key handling: replays, coalescing, locking and expiry."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException, Response
+from mongomock_motor import AsyncMongoMockClient
+
+from idempotency import DONE, IN_PROGRESS, REPLAY_HEADER, IdempotencyStore, fingerprint
+
+
+def database():
+    return AsyncMongoMockClient()["idempotency_test"]
+
+
+class Handler:
+    """Counts calls and answers with a body numbered by the call"""
+
+    def __init__(self, status_code: int = 201, delay: float = 0.0, error: Exception = None):
+        self.status_code = status_code
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self) -> Response:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return Response(
+            content=f'{{"call":{self.calls}}}'.encode(), status_code=self.status_code,
+            media_type="application/json", headers={"X-Read-Token": f"token-{self.calls}"},
+        )
+
+
+def test_replays_return_the_first_response():
+    async def scenario():
+        store, handler = IdempotencyStore(database()), Handler()
+        first = await store.run("orders", "key", {"plan": "a"}, handler)
+        replay = await store.run("orders", "key", {"plan": "a"}, handler)
+
+        assert handler.calls == 1
+        assert (replay.status_code, replay.body) == (first.status_code, first.body) == (201, b'{"call":1}')
+        assert REPLAY_HEADER.lower() not in first.headers
+        assert replay.headers[REPLAY_HEADER] == "true"
+        assert replay.headers["x-read-token"] == first.headers["x-read-token"] == "token-1"
+        assert store.replays == 1
+
+    asyncio.run(scenario())
+
+
+def test_keys_are_scoped():
+    async def scenario():
+        store, handler = IdempotencyStore(database()), Handler()
+        await store.run("orders", "key", {}, handler)
+        await store.run("checkout_session", "key", {}, handler)
+        assert handler.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_duplicates_share_one_run():
+    async def scenario():
+        store, handler = IdempotencyStore(database()), Handler(delay=0.05)
+        responses = await asyncio.gather(*[store.run("orders", "key", {}, handler) for _ in range(5)])
+
+        assert handler.calls == 1
+        assert {response.body for response in responses} == {b'{"call":1}'}
+        assert [response.headers.get(REPLAY_HEADER) for response in responses].count("true") == 4
+
+    asyncio.run(scenario())
+
+
+def test_another_worker_replays_the_stored_response():
+    async def scenario():
+        db = database()
+        handler = Handler()
+        first = await IdempotencyStore(db).run("orders", "key", {}, handler)
+        replay = await IdempotencyStore(db).run("orders", "key", {}, handler)
+
+        assert handler.calls == 1
+        assert replay.body == first.body
+        assert replay.headers["x-read-token"] == "token-1"
+
+    asyncio.run(scenario())
+
+
+def test_another_worker_waits_for_the_first_to_finish():
+    async def scenario():
+        db = database()
+        handler = Handler(delay=0.1)
+        first, second = await asyncio.gather(
+            IdempotencyStore(db).run("orders", "key", {}, handler),
+            IdempotencyStore(db, poll_interval=0.01).run("orders", "key", {}, handler),
+        )
+        assert handler.calls == 1
+        assert second.body == first.body
+        assert second.headers[REPLAY_HEADER] == "true"
+
+    asyncio.run(scenario())
+
+
+def test_key_reused_for_a_different_request_is_rejected():
+    async def scenario():
+        store = IdempotencyStore(database())
+        await store.run("orders", "key", {"plan": "a"}, Handler())
+        with pytest.raises(HTTPException) as rejected:
+            await store.run("orders", "key", {"plan": "b"}, Handler())
+        assert rejected.value.status_code == 422
+
+    asyncio.run(scenario())
+
+
+def test_overlong_keys_are_rejected():
+    async def scenario():
+        with pytest.raises(HTTPException) as rejected:
+            await IdempotencyStore(database()).run("orders", "k" * 256, {}, Handler())
+        assert rejected.value.status_code == 400
+
+    asyncio.run(scenario())
+
+
+def test_exceptions_release_the_key():
+    async def scenario():
+        db = database()
+        store = IdempotencyStore(db)
+        with pytest.raises(RuntimeError):
+            await store.run("orders", "key", {}, Handler(error=RuntimeError("boom")))
+        assert await db.idempotency_keys.count_documents({}) == 0
+
+        handler = Handler()
+        response = await store.run("orders", "key", {}, handler)
+        assert handler.calls == 1
+        assert response.status_code == 201
+
+    asyncio.run(scenario())
+
+
+def test_server_errors_release_the_key():
+    async def scenario():
+        db = database()
+        store = IdempotencyStore(db)
+        failed = await store.run("orders", "key", {}, Handler(status_code=503))
+        assert failed.status_code == 503
+        assert await db.idempotency_keys.count_documents({}) == 0
+
+        handler = Handler()
+        assert (await store.run("orders", "key", {}, handler)).status_code == 201
+        assert handler.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_client_errors_are_stored():
+    async def scenario():
+        store, handler = IdempotencyStore(database()), Handler(status_code=404)
+        await store.run("orders", "key", {}, handler)
+        replay = await store.run("orders", "key", {}, handler)
+        assert handler.calls == 1
+        assert replay.status_code == 404
+
+    asyncio.run(scenario())
+
+
+def test_lock_held_by_a_dead_request_is_taken_over():
+    async def scenario():
+        db = database()
+        await db.idempotency_keys.insert_one({
+            "_id": "orders:key", "fingerprint": "stale", "status": IN_PROGRESS,
+            "created_at": datetime.utcnow() - timedelta(seconds=60),
+        })
+        handler = Handler()
+        response = await IdempotencyStore(db, lock_timeout=30.0).run("orders", "key", {}, handler)
+        assert handler.calls == 1
+        assert response.status_code == 201
+
+    asyncio.run(scenario())
+
+
+def test_live_lock_is_waited_for_not_run():
+    async def scenario():
+        db = database()
+        await db.idempotency_keys.insert_one({
+            "_id": "orders:key", "fingerprint": fingerprint({}), "status": IN_PROGRESS, "created_at": datetime.utcnow(),
+        })
+
+        async def finish():
+            await asyncio.sleep(0.05)
+            await db.idempotency_keys.update_one({"_id": "orders:key"}, {"$set": {
+                "status": DONE, "status_code": 201, "body": b'{"call":0}', "media_type": "application/json",
+            }})
+
+        handler = Handler()
+        response, _ = await asyncio.gather(
+            IdempotencyStore(db, lock_timeout=5.0, poll_interval=0.01).run("orders", "key", {}, handler), finish()
+        )
+        assert handler.calls == 0
+        assert response.body == b'{"call":0}'
+        assert response.headers[REPLAY_HEADER] == "true"
+
+    asyncio.run(scenario())
+
+
+def test_keys_expire_after_the_ttl():
+    async def scenario():
+        db = database()
+        store, handler = IdempotencyStore(db, ttl=0.05), Handler()
+        await store.run("orders", "key", {}, handler)
+        await store.run("orders", "key", {}, handler)
+        assert handler.calls == 1
+
+        # Neither the in-process cache nor a record the TTL monitor has not removed yet replays it
+        await asyncio.sleep(0.1)
+        response = await store.run("orders", "key", {}, handler)
+        assert handler.calls == 2
+        assert response.body == b'{"call":2}'
+        assert REPLAY_HEADER.lower() not in response.headers
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+"""Email outbox delivery against a local aiosmtpd server."""
+import asyncio
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+from mongomock_motor import AsyncMongoMockClient
+
+from mailer import FAILED, SENT, EmailOutbox, SMTPSettings
+
+
+class RecordingHandler:
+    """Accepts every message, after answering 451 to the first ``defer`` deliveries of each recipient"""
+
+    def __init__(self, defer: int = 0):
+        self.defer = defer
+        self.deferred = {}
+        self.messages = []
+        self.connections = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.connections.add(session.peer)
+        recipient = envelope.rcpt_tos[0]
+        if self.deferred.get(recipient, 0) < self.defer:
+            self.deferred[recipient] = self.deferred.get(recipient, 0) + 1
+            return "451 Requested action aborted: try again later"
+        self.messages.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(handler):
+        controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        servers.append(controller)
+        return SMTPSettings(host="127.0.0.1", port=controller.port, starttls=False, timeout=5.0)
+
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+async def deliver(settings, messages, timeout=10.0, **options):
+    """Queue ``messages``, run the outbox until none is pending, return the stored documents"""
+    db = AsyncMongoMockClient()["outbox_test"]
+    outbox = EmailOutbox(db, settings, poll_interval=0.02, **options)
+    outbox.start()
+    try:
+        await outbox.enqueue_many(messages)
+        deadline = time.monotonic() + timeout
+        while await db.email_outbox.count_documents({"status": {"$nin": [SENT, FAILED]}}):
+            assert time.monotonic() < deadline, "outbox did not settle"
+            await asyncio.sleep(0.02)
+    finally:
+        await outbox.stop()
+    return await db.email_outbox.find().to_list(None)
+
+
+def message(index: int) -> dict:
+    return {"to": f"user{index}@example.com", "subject": f"Order {index}", "text": "Thanks!", "html": "<p>Thanks!</p>"}
+
+
+def test_outbox_delivers_every_message(smtp_server):
+    handler = RecordingHandler()
+    settings = smtp_server(handler)
+
+    stored = asyncio.run(deliver(settings, [message(i) for i in range(7)], workers=2))
+
+    assert [doc["status"] for doc in stored] == [SENT] * 7
+    assert sorted(envelope.rcpt_tos[0] for envelope in handler.messages) == sorted(m["to"] for m in map(message, range(7)))
+    assert all(envelope.mail_from == settings.sender for envelope in handler.messages)
+
+
+def test_outbox_retries_deferred_messages_with_backoff(smtp_server):
+    handler = RecordingHandler(defer=2)
+    settings = smtp_server(handler)
+
+    stored = asyncio.run(deliver(settings, [message(i) for i in range(3)], base_backoff=0.05))
+
+    assert [doc["status"] for doc in stored] == [SENT] * 3
+    assert [doc["attempts"] for doc in stored] == [2] * 3
+    assert all("451" in doc["last_error"] for doc in stored)
+    assert len(handler.messages) == 3
+
+
+def test_rejections_keep_the_pooled_connection(smtp_server):
+    handler = RecordingHandler(defer=1)
+    settings = smtp_server(handler)
+
+    stored = asyncio.run(deliver(settings, [message(i) for i in range(4)], workers=1, base_backoff=0.01))
+
+    assert [doc["status"] for doc in stored] == [SENT] * 4
+    assert len(handler.connections) == 1
+
+
+def test_outbox_gives_up_after_max_attempts(smtp_server):
+    handler = RecordingHandler(defer=10)
+    settings = smtp_server(handler)
+
+    stored = asyncio.run(deliver(settings, [message(0)], base_backoff=0.01, max_attempts=3))
+
+    assert stored[0]["status"] == FAILED
+    assert stored[0]["attempts"] == 3
+    assert handler.messages == []
@@ -0,0 +1,137 @@
+"""Resumable in-place migration of stored documents to the compact schema."""
+import asyncio
+from datetime import datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+from migrate import CHECKPOINTS, MIGRATION, TARGETS, migrate_collection, upgrade
+from schema import SCHEMA_VERSION, VERSION_FIELD, order_document, order_from_document, transaction_from_document
+
+ORDERS, _, TRANSACTIONS = TARGETS
+CREATED = datetime(2026, 5, 4, 3, 2, 1)
+
+
+def database():
+    return AsyncMongoMockClient()["migrate_test"]
+
+
+def v1_order(n: int, **fields) -> dict:
+    return {
+        "id": f"order-{n}", "user_id": None, "user_email": "user@example.com", "subscription_plan_id": "pro",
+        "amount": 19.99, "currency": "USD", "status": "completed", "payment_session_id": None,
+        "created_at": CREATED + timedelta(minutes=n), "updated_at": CREATED + timedelta(minutes=n), **fields,
+    }
+
+
+def v1_transaction(n: int, **fields) -> dict:
+    return {
+        "id": f"tx-{n}", "session_id": None, "user_id": None, "user_email": "user@example.com",
+        "subscription_plan_id": "pro", "amount": 9.5, "currency": "usd", "status": "pending",
+        "payment_status": "pending", "metadata": {"user_email": "user@example.com", "coupon": "SPRING"},
+        "provisional_at": CREATED, "expires_at": None, "created_at": CREATED, "updated_at": CREATED, **fields,
+    }
+
+
+async def stored(db, collection: str) -> list:
+    return await db[collection].find({}, {"_id": 0}).sort([("id", 1)]).to_list(None)
+
+
+async def until(condition) -> None:
+    while not await condition():
+        await asyncio.sleep(0.001)
+
+
+def test_migrated_documents_read_back_unchanged_without_null_fields():
+    async def scenario():
+        db = database()
+        orders = [v1_order(n) for n in range(3)] + [v1_order(3, user_id="user-1", payment_session_id="cs_3")]
+        transactions = [v1_transaction(0), v1_transaction(1, session_id="cs_1", provisional_at=None)]
+        await db.orders.insert_many([dict(o) for o in orders])
+        await db.payment_transactions.insert_many([dict(tx) for tx in transactions])
+
+        assert await migrate_collection(db, ORDERS, 2, 0, False, False) == {"scanned": 4, "upgraded": 4, "skipped": 0}
+        assert await migrate_collection(db, TRANSACTIONS, 2, 0, False, False) == \
+            {"scanned": 2, "upgraded": 2, "skipped": 0}
+
+        migrated = await stored(db, "orders")
+        assert all(doc[VERSION_FIELD] == SCHEMA_VERSION for doc in migrated)
+        assert migrated == [order_document(o) for o in orders]
+        assert all(None not in doc.values() for doc in migrated)
+        assert [order_from_document(doc) for doc in migrated] == orders
+
+        migrated = await stored(db, "payment_transactions")
+        assert all(None not in doc.values() for doc in migrated)
+        assert [transaction_from_document(doc) for doc in migrated] == [
+            {**tx, "metadata": {"coupon": "SPRING"}} for tx in transactions
+        ]
+
+    asyncio.run(scenario())
+
+
+def test_interrupted_run_resumes_from_its_checkpoint():
+    async def scenario():
+        db = database()
+        await db.orders.insert_many([v1_order(n) for n in range(6)])
+        checkpoint_id = f"{MIGRATION}:orders"
+
+        # Throttled to one batch a second, and stopped after the first one
+        run = asyncio.ensure_future(migrate_collection(db, ORDERS, 2, 2, False, False))
+        await until(lambda: db[CHECKPOINTS].find_one({"_id": checkpoint_id}))
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+        assert await db.orders.count_documents({VERSION_FIELD: SCHEMA_VERSION}) == 2
+
+        resumed = await migrate_collection(db, ORDERS, 2, 0, False, False)
+        assert resumed == {"scanned": 4, "upgraded": 6, "skipped": 0}
+        assert await db.orders.count_documents({VERSION_FIELD: SCHEMA_VERSION}) == 6
+        assert "completed_at" in await db[CHECKPOINTS].find_one({"_id": checkpoint_id})
+
+        # Nothing after the checkpoint; --restart rescans and finds everything already upgraded
+        assert await migrate_collection(db, ORDERS, 2, 0, False, False) == {"scanned": 0, "upgraded": 6, "skipped": 0}
+        assert await migrate_collection(db, ORDERS, 2, 0, True, False) == {"scanned": 6, "upgraded": 0, "skipped": 0}
+
+    asyncio.run(scenario())
+
+
+def test_dry_run_counts_without_writing():
+    async def scenario():
+        db = database()
+        await db.orders.insert_many([v1_order(n) for n in range(3)])
+        await db.orders.insert_one(order_document(v1_order(3)))
+
+        assert await migrate_collection(db, ORDERS, 2, 0, False, True) == {"scanned": 4, "upgraded": 3, "skipped": 0}
+        assert await db.orders.count_documents({VERSION_FIELD: SCHEMA_VERSION}) == 1
+        assert await db[CHECKPOINTS].count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_invalid_documents_are_skipped_and_left_readable():
+    async def scenario():
+        db = database()
+        broken = v1_order(1)
+        del broken["amount"]
+        await db.orders.insert_many([v1_order(0), dict(broken)])
+
+        assert await migrate_collection(db, ORDERS, 10, 0, False, False) == {"scanned": 2, "upgraded": 1, "skipped": 1}
+        assert (await stored(db, "orders"))[1] == broken
+
+    asyncio.run(scenario())
+
+
+def test_field_set_by_the_api_mid_migration_is_not_unset():
+    async def scenario():
+        db = database()
+        await db.payment_transactions.insert_one(v1_transaction(0))
+        operation = upgrade(await db.payment_transactions.find_one({}), TRANSACTIONS)
+
+        # The checkout pipeline records the Stripe session between the read and the write
+        await db.payment_transactions.update_one({"id": "tx-0"}, {"$set": {"session_id": "cs_0"}})
+        result = await db.payment_transactions.bulk_write([operation])
+        assert result.modified_count == 0
+
+        doc = await db.payment_transactions.find_one({})
+        assert doc["session_id"] == "cs_0"
+        assert VERSION_FIELD not in doc
+
+    asyncio.run(scenario())
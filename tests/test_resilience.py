@@ -0,0 +1,227 @@
+"""Circuit breaker, bulkhead and retry behaviour of ResiliencePolicy."""
+import asyncio
+
+import pytest
+
+from resilience import CLOSED, HALF_OPEN, OPEN, Bulkhead, CircuitBreaker, DependencyUnavailable, ResiliencePolicy
+
+
+class ClientError(Exception):
+    pass
+
+
+def policy(failure_threshold=2, reset_timeout=0.05, max_concurrent=2, max_wait=0.01) -> ResiliencePolicy:
+    return ResiliencePolicy(
+        "stripe",
+        CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+        Bulkhead(max_concurrent=max_concurrent, max_wait=max_wait),
+        client_errors=(ClientError,),
+        retry_base_delay=0.001,
+        retry_max_delay=0.001,
+    )
+
+
+async def succeed():
+    return "ok"
+
+
+async def fail():
+    raise ConnectionError("down")
+
+
+async def open_breaker(guarded: ResiliencePolicy) -> None:
+    for _ in range(guarded.breaker.failure_threshold):
+        with pytest.raises(ConnectionError):
+            await guarded.call(fail, timeout=1.0)
+    assert guarded.breaker.state == OPEN
+
+
+async def until(condition) -> None:
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+async def wait_for_reset(guarded: ResiliencePolicy) -> None:
+    await asyncio.sleep(guarded.breaker.reset_timeout + 0.01)
+
+
+def test_breaker_opens_after_consecutive_failures_and_rejects():
+    async def scenario():
+        guarded = policy()
+        await open_breaker(guarded)
+        with pytest.raises(DependencyUnavailable) as rejected:
+            await guarded.call(succeed, timeout=1.0)
+        assert rejected.value.reason == "circuit_open"
+        assert rejected.value.retry_after > 0
+        assert guarded.stats()["rejections"] == {"circuit_open": 1}
+
+    asyncio.run(scenario())
+
+
+def test_success_resets_the_failure_count():
+    async def scenario():
+        guarded = policy(failure_threshold=2)
+        with pytest.raises(ConnectionError):
+            await guarded.call(fail, timeout=1.0)
+        assert await guarded.call(succeed, timeout=1.0) == "ok"
+        with pytest.raises(ConnectionError):
+            await guarded.call(fail, timeout=1.0)
+        assert guarded.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_successful_trial_closes_the_breaker():
+    async def scenario():
+        guarded = policy()
+        await open_breaker(guarded)
+        await wait_for_reset(guarded)
+        assert await guarded.call(succeed, timeout=1.0) == "ok"
+        assert guarded.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_failed_trial_reopens_the_breaker():
+    async def scenario():
+        guarded = policy()
+        await open_breaker(guarded)
+        await wait_for_reset(guarded)
+        with pytest.raises(ConnectionError):
+            await guarded.call(fail, timeout=1.0)
+        assert guarded.breaker.state == OPEN
+        with pytest.raises(DependencyUnavailable):
+            await guarded.call(succeed, timeout=1.0)
+
+    asyncio.run(scenario())
+
+
+def test_only_one_trial_at_a_time():
+    async def scenario():
+        guarded = policy()
+        await open_breaker(guarded)
+        await wait_for_reset(guarded)
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "ok"
+
+        trial = asyncio.ensure_future(guarded.call(slow, timeout=1.0))
+        await until(lambda: guarded.bulkhead.in_flight == 1)
+        assert guarded.breaker.state == HALF_OPEN
+        with pytest.raises(DependencyUnavailable) as rejected:
+            await guarded.call(succeed, timeout=1.0)
+        assert rejected.value.reason == "circuit_open"
+        release.set()
+        assert await trial == "ok"
+        assert guarded.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_trial_lets_the_next_call_through():
+    async def scenario():
+        guarded = policy()
+        await open_breaker(guarded)
+        await wait_for_reset(guarded)
+
+        trial = asyncio.ensure_future(guarded.call(asyncio.Event().wait, timeout=1.0))
+        await until(lambda: guarded.bulkhead.in_flight == 1)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert guarded.bulkhead.in_flight == 0
+
+        for _ in range(3):
+            assert await guarded.call(succeed, timeout=1.0) == "ok"
+        assert guarded.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_trial_rejected_by_the_bulkhead_lets_the_next_call_through():
+    async def scenario():
+        guarded = policy(max_concurrent=1)
+        await open_breaker(guarded)
+        await wait_for_reset(guarded)
+
+        await guarded.bulkhead.acquire()  # held by a call that started before the breaker opened
+        with pytest.raises(DependencyUnavailable) as rejected:
+            await guarded.call(succeed, timeout=1.0)
+        assert rejected.value.reason == "bulkhead_full"
+        guarded.bulkhead.release()
+
+        assert await guarded.call(succeed, timeout=1.0) == "ok"
+        assert guarded.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_bulkhead_rejects_calls_beyond_its_limit():
+    async def scenario():
+        guarded = policy(max_concurrent=2)
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "ok"
+
+        running = [asyncio.ensure_future(guarded.call(slow, timeout=1.0)) for _ in range(2)]
+        await until(lambda: guarded.bulkhead.in_flight == 2)
+        with pytest.raises(DependencyUnavailable) as rejected:
+            await guarded.call(succeed, timeout=1.0)
+        assert rejected.value.reason == "bulkhead_full"
+        release.set()
+        assert await asyncio.gather(*running) == ["ok", "ok"]
+        assert guarded.bulkhead.in_flight == 0
+        assert guarded.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_timeouts_count_as_failures():
+    async def scenario():
+        guarded = policy(failure_threshold=1)
+        with pytest.raises(DependencyUnavailable) as rejected:
+            await guarded.call(asyncio.Event().wait, timeout=0.01)
+        assert rejected.value.reason == "timeout"
+        assert guarded.breaker.state == OPEN
+
+    asyncio.run(scenario())
+
+
+def test_client_errors_are_not_retried_or_counted():
+    async def scenario():
+        guarded = policy(failure_threshold=1)
+        calls = []
+
+        async def bad_request():
+            calls.append(1)
+            raise ClientError("no such session")
+
+        with pytest.raises(ClientError):
+            await guarded.call(bad_request, timeout=1.0, retries=3)
+        assert len(calls) == 1
+        assert guarded.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_transient_failures_are_retried():
+    async def scenario():
+        guarded = policy(failure_threshold=5)
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ConnectionError("reset")
+            return "ok"
+
+        assert await guarded.call(flaky, timeout=1.0, retries=2) == "ok"
+        assert len(calls) == 3
+        assert guarded.breaker.state == CLOSED
+        assert guarded.breaker.failures == 0
+
+    asyncio.run(scenario())
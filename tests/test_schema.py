@@ -0,0 +1,56 @@
+"""Round trips between the API shape and the compact (v2) stored documents."""
+from datetime import datetime, timedelta
+
+from schema import (
+    ORDER_V1_ONLY, SCHEMA_VERSION, TRANSACTION_V1_ONLY, VERSION_FIELD, order_document, order_from_document,
+    transaction_document, transaction_from_document,
+)
+
+CREATED = datetime(2026, 5, 4, 3, 2, 1)
+
+
+def order(**fields) -> dict:
+    return {
+        "id": "order-1", "user_id": "user-1", "user_email": "user@example.com", "subscription_plan_id": "pro",
+        "amount": 19.99, "currency": "USD", "status": "completed", "payment_session_id": "cs_1",
+        "created_at": CREATED, "updated_at": CREATED, **fields,
+    }
+
+
+def transaction(**fields) -> dict:
+    return {
+        "id": "tx-1", "session_id": "cs_1", "user_id": "user-1", "user_email": "user@example.com",
+        "subscription_plan_id": "pro", "amount": 0.29, "currency": "usd", "status": "pending",
+        "payment_status": "pending", "metadata": {"subscription_plan_id": "pro", "user_email": "user@example.com"},
+        "provisional_at": None, "expires_at": CREATED + timedelta(days=30),
+        "created_at": CREATED, "updated_at": CREATED + timedelta(seconds=5), **fields,
+    }
+
+
+def test_order_round_trip():
+    for original in (order(), order(user_id=None, user_email=None, payment_session_id=None)):
+        stored = order_document(original)
+        assert stored[VERSION_FIELD] == SCHEMA_VERSION
+        assert stored["amt"] == 1999
+        assert not set(ORDER_V1_ONLY) & set(stored)
+        assert None not in stored.values()
+        assert order_from_document(stored) == original
+
+
+def test_transaction_round_trip_keeps_only_extra_metadata():
+    original = transaction()
+    stored = transaction_document(original)
+    assert stored["amt"] == 29
+    assert "md" not in stored and "provisional_at" not in stored
+    assert not set(TRANSACTION_V1_ONLY) & set(stored)
+    # The redundant metadata keys come back from the document itself, not from storage
+    assert transaction_from_document(stored) == {**original, "metadata": None}
+
+    original = transaction(metadata={"user_email": "user@example.com", "coupon": "SPRING"}, session_id=None)
+    restored = transaction_from_document(transaction_document(original))
+    assert restored == {**original, "metadata": {"coupon": "SPRING"}}
+
+
+def test_v1_documents_are_read_unchanged():
+    assert order_from_document(order()) == order()
+    assert transaction_from_document(transaction()) == transaction()